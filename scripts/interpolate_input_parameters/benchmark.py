@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import synthetic_archive
+import parse_realtime as prt
+import interpolate_input_parameters as iip
+from profiling import StageProfiler
+
+# stage timings of the input parameter scripts on synthetic_archive trees,
+# reported as wall time and throughput in simulated minutes per second.
+# every stage is run repeat times and the best time is kept.
+#
+#   archive  (interpolate_input_parameters.py): run, parse, netcdf, text
+#   realtime (parse_realtime.py):   read, interpolate, average, netcdf, text
+#   wrapper  (realtime_wrapper.py): segments, incremental InputParameters
+#                                   stepped over the tree like the wrapper
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def best(func, repeat):
+    # (fastest wall time of repeat calls, result of the last call)
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+def report(results, name, seconds, minutes):
+    results.append({'stage': name, 'seconds': seconds, 'minutes': minutes,
+                    'minutes_per_s': minutes / seconds if seconds > 0 else float('inf')})
+    print('{:<24}{:>10.4f} s{:>14.0f} min/s'.format(name, seconds, results[-1]['minutes_per_s']))
+
+def bench_archive(root, start, hours, repeat, results):
+    # start: YYYYMMDDHH string
+    minutes = hours*60 + 1
+    argv = ['interpolate_input_parameters.py', '-s', start, '-d', str(hours), '-p', root, '-m', 'timeobs']
+
+    seconds, _ = best(lambda: subprocess.run([sys.executable, os.path.join(HERE, argv[0])] + argv[1:],
+                                             check=True, stdout=subprocess.DEVNULL), repeat)
+    report(results, 'archive run', seconds, minutes)
+
+    # fresh DriverArchive per parse so every repeat reads its files
+    seconds, drivers = best(lambda: iip.build_drivers(start, hours, 'timeobs', iip.DriverArchive(root)), repeat)
+    report(results, 'archive parse', seconds, minutes)
+
+    # both files are written together, as the run writes them, and the
+    # write_drivers profiler stages split the time between them. the
+    # profiler only counts with a log, which is never flushed here
+    def output():
+        profiler = StageProfiler(os.devnull)
+        iip.write_drivers(drivers, start, 'input_parameters.nc', 'wam_input_f107_kp.txt', profiler)
+        return profiler.stages
+    stages = [output() for _ in range(repeat)]
+    report(results, 'archive netcdf', min(s['netcdf_output']['seconds'] for s in stages), minutes)
+    report(results, 'archive text', min(s['txt_output']['seconds'] for s in stages), minutes)
+
+def realtime_parameters(root, start, minutes, **kwargs):
+    end = datetime.strptime(prt.EDATE, '%Y%m%d%H%M')
+    return prt.InputParameters(start, minutes, root, 'input_parameters.nc', False, True, end, end, end, **kwargs)
+
+def bench_realtime(root, start, minutes, repeat, results):
+    def read():
+        ip = realtime_parameters(root, start, minutes)
+        return ip, ip.read(prt.SerialPool())[0]
+    seconds, _ = best(read, repeat)
+    report(results, 'realtime read', seconds, minutes)
+
+    def interpolate():
+        ip, jobs = read()
+        t0 = time.perf_counter()
+        ip.merge(jobs)
+        return time.perf_counter() - t0, ip
+    times = [interpolate() for _ in range(repeat)]
+    report(results, 'realtime interpolate', min(t for t, _ in times), minutes)
+    ip = times[-1][1]
+
+    series = [ip.swbz, ip.swby, ip.swbx, ip.swden, ip.swvel]
+    seconds, _ = best(lambda: [s.trailing_mean(s.base, len(s), prt.AVERAGING_INTERVAL) for s in series], repeat)
+    report(results, 'realtime average', seconds, minutes)
+
+    def netcdf():
+        ip.write_netcdf('input_parameters.nc', *ip.netcdf_fields())
+        ip.close()
+    seconds, _ = best(netcdf, repeat)
+    report(results, 'realtime netcdf', seconds, minutes)
+    seconds, _ = best(lambda: ip.write_txt('wam_input_f107_kp.txt', *ip.txt_columns()), repeat)
+    report(results, 'realtime text', seconds, minutes)
+
+def bench_wrapper(root, start, minutes, segment, repeat, results):
+    def run():
+        ip = realtime_parameters(root, start, segment, incremental=True)
+        ip.parse()
+        ip.netcdf_output()
+        ip.output()
+        ip.append = True
+        for i in range(segment, minutes, segment):
+            ip.segment(start + timedelta(minutes=i), segment)
+            ip.parse()
+            ip.netcdf_output()
+            ip.output()
+        ip.close()
+    seconds, _ = best(run, repeat)
+    report(results, 'wrapper segments', seconds, minutes)
+
+def main():
+    parser = ArgumentParser(description='Time the stages of the input parameter scripts on synthetic input',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-a', '--archive_hours',  help='hours of interpolate_input_parameters.py run, 0 to skip', type=int, default=48)
+    parser.add_argument('-t', '--realtime_hours', help='hours of parse_realtime.py run, 0 to skip', type=int, default=24)
+    parser.add_argument('-d', '--duration',       help='minutes per realtime_wrapper segment', type=int, default=15)
+    parser.add_argument('-g', '--gap',            help='fraction of realtime records left out', type=float, default=0.05)
+    parser.add_argument('-r', '--repeat',         help='runs per stage, the fastest is reported', type=int, default=3)
+    parser.add_argument('-w', '--workdir',        help='directory for input trees and output, temporary if unset', type=str, default=None)
+    parser.add_argument('-j', '--json',           help='append the results to this JSON-lines file', type=str, default=None)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='iip_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    here = os.getcwd()
+    json_file = os.path.abspath(args.json) if args.json else None
+    results = []
+    try:
+        os.chdir(workdir)
+        if args.archive_hours > 0:
+            start = datetime(2013, 3, 1)
+            root  = os.path.join(workdir, 'archive')
+            if not os.path.isdir(root):
+                synthetic_archive.write_archive(root, start, args.archive_hours // 24 + 1)
+            bench_archive(root, start.strftime('%Y%m%d%H'), args.archive_hours, args.repeat, results)
+        if args.realtime_hours > 0:
+            # data starts far enough back for the first minute to have
+            # geospace history and a wam_input file issued before it
+            start = datetime(2020, 6, 1)
+            first = start + timedelta(minutes=prt.SW_DATE_BACKWARDS + prt.DELAY_INTERVAL + 3*60)
+            root  = os.path.join(workdir, 'realtime')
+            if not os.path.isdir(root):
+                synthetic_archive.write_realtime(root, start, args.realtime_hours + 8, args.gap)
+            bench_realtime(root, first, args.realtime_hours*60, args.repeat, results)
+            bench_wrapper(root, first, args.realtime_hours*60, args.duration, args.repeat, results)
+    finally:
+        os.chdir(here)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if json_file is not None:
+        with open(json_file, 'a') as f:
+            f.write(json.dumps({'date': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args),
+                                'results': results}) + '\n')
+
+if __name__ == '__main__':
+    main()
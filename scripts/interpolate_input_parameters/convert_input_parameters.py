@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from driver_output import NC_FORMAT, NC_FORMATS, NC_CHUNK, NC_COMPLEVEL, convert_netcdf
+
+# convert an input_parameters.nc file between the NETCDF3 layout the model
+# reads and the chunked, compressed NETCDF4 layout used for archiving
+
+def main():
+    parser = ArgumentParser(description='Convert input_parameters.nc between NETCDF3 and compressed NETCDF4',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input',               help='input_parameters.nc file to read', type=str)
+    parser.add_argument('output',              help='file to write', type=str)
+    parser.add_argument('-F', '--nc_format',   help='format of the output', type=str, default=NC_FORMAT, choices=NC_FORMATS)
+    parser.add_argument('-n', '--chunk',       help='records per chunk of NETCDF4 output', type=int, default=NC_CHUNK)
+    parser.add_argument('-z', '--complevel',   help='deflate level of NETCDF4 output (1-9)', type=int, default=NC_COMPLEVEL)
+    args = parser.parse_args()
+
+    convert_netcdf(args.input, args.output, args.nc_format, args.chunk, args.complevel)
+
+if __name__ == '__main__':
+    main()
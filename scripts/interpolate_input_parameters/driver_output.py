@@ -0,0 +1,162 @@
+from datetime import datetime
+from itertools import chain
+import numpy as np
+from netCDF4 import Dataset
+
+# shared writers for the wam_input_f107_kp.txt and input_parameters.nc driver
+# files produced by interpolate_input_parameters.py and parse_realtime.py
+
+EPOCH   = datetime(1970, 1, 1)
+EPOCH64 = np.datetime64('1970-01-01T00:00', 'm')
+
+# one row per sample: timestamp, then the TXT_COLUMNS values with the constant
+# F10Flag/KpFlag fields. the hemispheric power indices use %s so they are
+# written as given, whether the caller holds them as ints or floats
+TXT_COLUMNS = [ 'f107', 'kp', 'f107d', 'kpa', 'nhp', 'nhpi', 'shp', 'shpi',
+                'swbt', 'swang', 'swvel', 'swbz', 'swden' ]
+TXT_ROW_FMT = '%sZ%12.7f%12.7f{:>12}{:>12}%12.7f%12.7f%12.7f%12s%12.7f%12s%12.7f%12.7f%12.7f%12.7f%12.7f\n'.format('2', '1')
+TXT_CHUNK   = 1440 # rows formatted per write
+
+# input_parameters.nc variables, all on the unlimited 'time' dimension. files
+# are NC_FORMAT unless NC4_FORMAT is asked for, which chunks the time
+# dimension and deflates each variable after a byte shuffle
+NC_FORMAT    = 'NETCDF3_64BIT_OFFSET'
+NC4_FORMAT   = 'NETCDF4'
+NC_FORMATS   = [ NC_FORMAT, NC4_FORMAT ]
+NC_CHUNK     = 1440 # records per NETCDF4 chunk
+NC_COMPLEVEL = 4    # NETCDF4 deflate level, 1-9
+VAR_NAMES = [ 'f107', 'kp', 'f107d', 'kpa', 'nhp', 'nhpi', 'shp', 'shpi', 'swbt',
+              'swang', 'swvel', 'swbz', 'swden', 'ap', 'apa' ]
+VAR_TYPES = [ 'f4', 'f4', 'f4', 'f4', 'f4', 'i2', 'f4', 'i2', 'f4',
+              'f4', 'f4', 'f4', 'f4', 'f4', 'f4' ]
+VAR_LONG_NAMES = [ '10.7cm Solar Radio Flux' , 'Kp Index', '41-Day F10.7 Average', '24hr Kp Average',
+                   'Northern Hemispheric Power', 'Northern Hemispheric Power Index',
+                   'Southern Hemispheric Power', 'Southern Hemispheric Power Index',
+                   'IMF Total B Strength', 'Solar Wind Angle', 'Solar Wind Velocity',
+                   'IMF Bz Strength', 'Solar Wind Density', 'Ap Index', '24hr Ap Average' ]
+VAR_UNITS = [ 'sfu', None, 'sfu', None, 'GW', None, 'GW', None,
+              'nT', 'degrees', 'km/s', 'nT', 'cm^-3', None, None ]
+
+def epoch_minutes(dt):
+    # integer minutes from EPOCH to datetime dt
+    return int((dt - EPOCH).total_seconds() // 60)
+
+def timestamps(minutes):
+    # YYYY-mm-ddTHH:MM:SS strings (without the trailing Z) for minutes since EPOCH
+    return np.datetime_as_string(EPOCH64 + np.asarray(minutes, dtype='int64').astype('timedelta64[m]'), unit='s')
+
+def chunk_records(segment, target=NC_CHUNK):
+    # NETCDF4 chunk length for writes of segment records: whole segments,
+    # at least target records, so chunks end where segments do without
+    # short segments giving chunks too small to compress
+    return segment * max(1, -(-target // segment))
+
+def write_txt_rows(f, minutes, columns, chunk=TXT_CHUNK):
+    # f:       open text file
+    # minutes: minutes since EPOCH of each row
+    # columns: sequence of arrays ordered as TXT_COLUMNS
+    stamps = timestamps(minutes)
+    for i in range(0, len(stamps), chunk):
+        block = [stamps[i:i+chunk].tolist()] + [np.asarray(c)[i:i+chunk].tolist() for c in columns]
+        f.write((TXT_ROW_FMT * len(block[0])) % tuple(chain.from_iterable(zip(*block))))
+
+class NetcdfWriter(object):
+    # keeps an input_parameters.nc file open across writes and tracks the
+    # record count itself, so each write is one slice per variable after the
+    # last record. global attributes are only rewritten when they change.
+    # sync_every: sync to disk after this many writes, 0 syncs only on close
+    # format:     one of NC_FORMATS, an appended file keeps its own
+    # chunk:      records per chunk of the NETCDF4 variables
+    # complevel:  deflate level of the NETCDF4 variables
+    # every variable is written on each write, so the fill values netCDF
+    # would otherwise lay down as the record dimension grows are skipped
+    def __init__(self, filename, time_type='i4', time_units='minutes', append=False, sync_every=1,
+                 format=NC_FORMAT, chunk=NC_CHUNK, complevel=NC_COMPLEVEL):
+        self.filename   = filename
+        self.sync_every = sync_every
+        self.pending    = 0
+        self.attrs      = {}
+        self.nc = Dataset(filename, 'a' if append else 'w', format=format)
+        self.nc.set_fill_off()
+
+        if not append:
+            if format == NC4_FORMAT:
+                options = dict(zlib=True, complevel=complevel, shuffle=True, chunksizes=(chunk,))
+            else:
+                options = {}
+            self.nc.createDimension('time', None)
+            t_var = self.nc.createVariable('time', time_type, ('time',), **options)
+            t_var.units = time_units
+            for name, vtype, long_name, units in zip(VAR_NAMES, VAR_TYPES, VAR_LONG_NAMES, VAR_UNITS):
+                var = self.nc.createVariable(name, vtype, ('time',), **options)
+                var.long_name = long_name
+                if units is not None:
+                    var.units = units
+
+        self.records = len(self.nc.dimensions['time'])
+
+    def write(self, fields, attrs):
+        # fields: dict of 1-D arrays keyed by 'time' and every VAR_NAMES entry
+        # attrs:  dict of global attributes
+        for k, v in attrs.items():
+            if k not in self.attrs or self.attrs[k] != v:
+                self.nc.setncattr(k, v)
+                self.attrs[k] = v
+
+        count = 0
+        for name, var in self.nc.variables.items():
+            values = np.asarray(fields[name]).astype(var.dtype, copy=False)
+            var[self.records:self.records+len(values)] = values
+            count = len(values)
+        self.records += count
+
+        self.pending += 1
+        if self.sync_every and self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.nc.sync()
+        self.pending = 0
+
+    def close(self):
+        if self.nc is not None:
+            self.nc.close()
+            self.nc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_netcdf(filename, fields, attrs, time_type='i4', time_units='minutes', append=False, format=NC_FORMAT):
+    # filename:   output file, created unless append is set
+    # fields:     dict of 1-D arrays keyed by 'time' and every VAR_NAMES entry
+    # attrs:      dict of global attributes
+    # time_type:  dtype of the time variable when the file is created
+    # time_units: units of the time variable when the file is created
+    # format:     one of NC_FORMATS when the file is created
+    # one-off write through a NetcdfWriter that is closed straight after
+    with NetcdfWriter(filename, time_type, time_units, append, 0, format) as writer:
+        writer.write(fields, attrs)
+
+def netcdf_layout(filename):
+    # format and records per chunk of an existing input_parameters.nc, the
+    # chunk is None unless the file is chunked
+    with Dataset(filename) as nc:
+        chunking = nc.variables['time'].chunking()
+        return nc.data_model, chunking[0] if isinstance(chunking, list) else None
+
+def convert_netcdf(src, dst, format=NC_FORMAT, chunk=NC_CHUNK, complevel=NC_COMPLEVEL):
+    # rewrite the input_parameters.nc file src as dst in format, e.g. a
+    # NETCDF4 archive back to the NETCDF3 layout for readers that need it.
+    # each variable is read whole and written as one slice, so the copy
+    # costs about as much as reading src once
+    with Dataset(src) as nc:
+        nc.set_auto_mask(False)
+        fields = dict((name, var[:]) for name, var in nc.variables.items())
+        attrs  = dict((k, nc.getncattr(k)) for k in nc.ncattrs())
+        time   = nc.variables['time']
+        time_type, time_units = time.dtype, time.units
+    with NetcdfWriter(dst, time_type, time_units, sync_every=0, format=format, chunk=chunk, complevel=complevel) as writer:
+        writer.write(fields, attrs)
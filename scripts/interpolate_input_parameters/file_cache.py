@@ -0,0 +1,95 @@
+import json
+import os
+import numpy as np
+
+# binary sidecars for text input files that never change once written.
+# a sidecar is only trusted while its mtime matches the source file's, so
+# rewriting the source invalidates it. sidecars live under cache_dir at the
+# source's absolute path, which keeps read-only archives untouched.
+
+def sidecar_name(filename, cache_dir, ext='.npy'):
+    return os.path.join(cache_dir, os.path.abspath(filename).lstrip(os.sep)) + ext
+
+def _fresh(sidecar, mtime_ns):
+    try:
+        return os.stat(sidecar).st_mtime_ns == mtime_ns
+    except OSError:
+        return False
+
+def _stamp(tmp, sidecar, mtime_ns):
+    # match the source mtime, then move into place so readers never see a partial file
+    os.utime(tmp, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp, sidecar)
+
+def load_array(filename, parse, cache_dir=None):
+    # filename:  source text file
+    # parse:     function of filename returning a numeric array
+    # cache_dir: sidecar root, parse every time if None
+    # returns a read-only memory map of the sidecar, or parse(filename) if it
+    # cannot be cached, and the bytes read for it: the source's size when it
+    # was parsed, none when a fresh sidecar was mapped, as pages are only
+    # read as they are touched
+    if cache_dir is None:
+        return parse(filename), os.path.getsize(filename)
+
+    st      = os.stat(filename)
+    sidecar = sidecar_name(filename, cache_dir)
+    if _fresh(sidecar, st.st_mtime_ns):
+        return np.load(sidecar, mmap_mode='r'), 0
+    arr = parse(filename)
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(sidecar, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, arr)
+        _stamp(tmp, sidecar, st.st_mtime_ns)
+    except OSError:
+        return arr, st.st_size
+    return np.load(sidecar, mmap_mode='r'), st.st_size
+
+class RecordCache(object):
+    # parsed records of small files that never change once written, keyed by
+    # directory, filename and mtime. with cache_dir set, each directory's
+    # records persist as JSON so later processes start warm
+    def __init__(self, parse, cache_dir=None, name='records.json'):
+        self.parse     = parse   # function of a full path returning a JSON-able record
+        self.cache_dir = cache_dir
+        self.name      = name
+        self.dirs      = {}      # directory -> {filename: [mtime_ns, record]}
+        self.dirty     = set()
+
+    def records(self, directory):
+        if directory not in self.dirs:
+            self.dirs[directory] = {}
+            if self.cache_dir is not None:
+                try:
+                    with open(sidecar_name(os.path.join(directory, self.name), self.cache_dir, '')) as f:
+                        self.dirs[directory] = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self.dirs[directory]
+
+    def get(self, directory, filename, mtime_ns):
+        # parse errors propagate and are not cached, so a file caught while
+        # still being written is retried next time
+        records = self.records(directory)
+        entry = records.get(filename)
+        if entry is None or entry[0] != mtime_ns:
+            entry = [mtime_ns, self.parse(os.path.join(directory, filename))]
+            records[filename] = entry
+            self.dirty.add(directory)
+        return entry[1]
+
+    def save(self):
+        if self.cache_dir is not None:
+            for directory in self.dirty:
+                target = sidecar_name(os.path.join(directory, self.name), self.cache_dir, '')
+                try:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    tmp = '{}.{}.tmp'.format(target, os.getpid())
+                    with open(tmp, 'w') as f:
+                        json.dump(self.dirs[directory], f)
+                    os.replace(tmp, target)
+                except OSError:
+                    pass
+        self.dirty.clear()
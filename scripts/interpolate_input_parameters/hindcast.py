@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import interpolate_input_parameters as iip
+
+# interpolate_input_parameters.py for a campaign of cycles. the database
+# files every cycle needs are parsed once in this process, then the cycles
+# are built and written on a pool of worker processes, each writing
+# <output>/<YYYYMMDDHH>/input_parameters.nc and wam_input_f107_kp.txt.
+# where fork is available the workers inherit the parsed files, elsewhere
+# each worker parses what its cycles need itself.
+
+DATE_FMT = '%Y%m%d%H'
+F107_DAYS = 41 # days either side of a cycle read for the F10.7 average
+
+source = None # DriverArchive of this process
+
+def cycles_from_range(start_date, end_date, step, duration):
+    # (YYYYMMDDHH, hours) every step hours from start_date to end_date inclusive
+    start = datetime.strptime(start_date, DATE_FMT)
+    end   = datetime.strptime(end_date, DATE_FMT)
+    cycles = []
+    while start <= end:
+        cycles.append((start.strftime(DATE_FMT), duration))
+        start += timedelta(hours=step)
+    return cycles
+
+def cycles_from_file(filename, duration):
+    # one YYYYMMDDHH per line, optionally followed by the hours of that cycle
+    cycles = []
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            cycles.append((fields[0], int(fields[1]) if len(fields) > 1 else duration))
+    return cycles
+
+def preload(source, cycles, mode):
+    # parse the union of the database files the cycles read. files that are
+    # missing are left for the cycles needing them to report
+    if mode[:4] != 'time':
+        return
+    years = set()
+    days  = set()
+    for start_date, duration in cycles:
+        end_date = iip.new_timestamp(start_date, duration)
+        years.update(range(int(iip.new_timestamp(start_date, -24*F107_DAYS)[:4]),
+                           int(iip.new_timestamp(end_date, 24*F107_DAYS)[:4]) + 1))
+        days.update(iip.hourless(d) for d in iip.get_dates(start_date, end_date))
+    for year in sorted(years):
+        try:
+            source.kp_ap_f107.load(str(year))
+        except (OSError, ValueError):
+            pass
+    for day in sorted(days):
+        for read in [source.kp_avg_day] + ([source.solar_day] if mode[-3:] == 'obs' else []):
+            try:
+                read(day + '00')
+            except (OSError, ValueError):
+                pass
+
+def init_worker(path, cache, fixed):
+    global source
+    if source is None:
+        source = iip.DriverArchive(path, cache, fixed, max_days=None)
+
+def run_cycle(start_date, duration, mode, output, interval, nc_format=iip.NC_FORMAT):
+    # build and write one cycle, returning (start_date, seconds, error or None)
+    t0 = time.perf_counter()
+    directory = os.path.join(output, start_date)
+    os.makedirs(directory, exist_ok=True)
+    try:
+        iip.run(start_date, duration, os.path.join(directory, 'input_parameters.nc'), mode, source, interval,
+                os.path.join(directory, 'wam_input_f107_kp.txt'), nc_format=nc_format)
+        error = None
+    except (iip.DriverError, OSError, ValueError) as e:
+        error = str(e)
+    except Exception as e:
+        # malformed archive data or a netCDF error fails this cycle only
+        error = '{}: {}'.format(type(e).__name__, e)
+    return start_date, time.perf_counter() - t0, error
+
+def run_campaign(cycles, path, mode='timeobs', output='.', workers=None, cache=None, fixed='', interval=1, nc_format=iip.NC_FORMAT):
+    # cycles:  (YYYYMMDDHH, hours) of each run
+    # workers: processes building cycles, None for one per cpu, 1 runs them here
+    # nc_format: format of each input_parameters.nc, see driver_output.py
+    # returns [(start_date, seconds, error or None)] in completion order
+    global source
+    source = iip.DriverArchive(path, cache, fixed, max_days=None)
+    preload(source, cycles, mode)
+
+    if workers == 1:
+        return [run_cycle(start_date, duration, mode, output, interval, nc_format) for start_date, duration in cycles]
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    results = []
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(path, cache, fixed)) as pool:
+        jobs = [pool.submit(run_cycle, start_date, duration, mode, output, interval, nc_format) for start_date, duration in cycles]
+        for job in as_completed(jobs):
+            results.append(job.result())
+    return results
+
+def main():
+    parser = ArgumentParser(description='Run interpolate_input_parameters.py for a campaign of cycles on a process pool',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-s', '--start_date', help='first cycle (YYYYMMDDhh)', type=str, default=None)
+    parser.add_argument('-e', '--end_date',   help='last cycle (YYYYMMDDhh), defaults to start_date', type=str, default=None)
+    parser.add_argument('-n', '--step',       help='hours between cycles', type=int, default=6)
+    parser.add_argument('-t', '--dates',      help='file of cycles, a YYYYMMDDhh and optional duration per line, instead of -s/-e', type=str, default=None)
+    parser.add_argument('-d', '--duration',   help='duration of each run (hours)', type=int, default=24)
+    parser.add_argument('-p', '--path',       help='path to database files', type=str, required=True)
+    parser.add_argument('-o', '--output',     help='directory for the per-cycle output directories', type=str, default='.')
+    parser.add_argument('-m', '--mode',       help='see interpolate_input_parameters.py', type=str, default='timeobs', choices=iip.MODES)
+    parser.add_argument('-f', '--fixed',      help='full path to file containing fixed data for run', type=str, default='')
+    parser.add_argument('-c', '--cache',      help='directory for binary sidecars of the AURORA_POWER files (no caching if unset)', type=str, default=None)
+    parser.add_argument('-i', '--interval',   help='interval length (minutes), must divide 36 hours', type=int, default=1)
+    parser.add_argument('-j', '--workers',    help='worker processes, one per cpu if unset', type=int, default=None)
+    parser.add_argument('-F', '--nc_format',  help='format of each input_parameters.nc', type=str, default=iip.NC_FORMAT, choices=iip.NC_FORMATS)
+    args = parser.parse_args()
+
+    if args.dates is not None:
+        cycles = cycles_from_file(args.dates, args.duration)
+    elif args.start_date is not None:
+        cycles = cycles_from_range(args.start_date, args.end_date or args.start_date, args.step, args.duration)
+    else:
+        parser.error('one of --start_date or --dates is required')
+
+    t0 = time.perf_counter()
+    results = run_campaign(cycles, args.path, args.mode, args.output, args.workers, args.cache, args.fixed, args.interval, args.nc_format)
+    failed = 0
+    for start_date, seconds, error in sorted(results):
+        if error is not None:
+            failed += 1
+            print('{} failed: {}'.format(start_date, error))
+    print('{} cycles, {} failed, {:.1f} s'.format(len(results), failed, time.perf_counter() - t0))
+
+if __name__ == '__main__':
+    main()
@@ -5,25 +5,44 @@ from os import path
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import datetime
 from itertools import chain
+from collections import OrderedDict, namedtuple
 import math
 from sw_from_f107_kp import *
-from netCDF4 import Dataset
+from driver_output import NC_FORMAT, NC_FORMATS, NC_CHUNK, epoch_minutes, write_txt_rows, chunk_records, NetcdfWriter
+from kp_ap import ap_from_kp
+from file_cache import load_array
+from profiling import StageProfiler
+from timeseries import RollingMean
 
 ## takes 3hr-avg Kp, daily F10.7, and minute-binned hemispheric power and 24hr-avg Kp
-## and translates them all to the same cadence (hard-coded 1 minute)
+## and translates them all to the same cadence (-i/--interval minutes)
 
 ## future todo
-# implement variable cadence
 # turn the YYYYMMDDHH strings into a class rather than having a mess of functions all over the place
 
-def compare_timestamp(date1,date2):
-  if datetime.datetime.strptime(date1,'%Y%m%d%H') == datetime.datetime.strptime(date2,'%Y-%m-%dT%H:%M:%SZ'):
-    return True
-  else:
-    return False
+## importable: build_drivers(start_date, duration, mode, source) returns the
+## driver arrays for a run, run() also writes them out. a DriverArchive source
+## keeps what it has parsed, so many runs in one process share it
+
+mins_per_kp_segment    = 3*60
+mins_per_f107_segment  = 24*60
+midpoint_f107          = 15*60
+midpoint_f107_fraction = float(midpoint_f107)/mins_per_f107_segment
+f107_midpoint_string   = '1500'
+kp_midpoint_string     = '0130'
+averaging_mins         = 20
+AVERAGING_INTERVAL = averaging_mins
+offset         = 20
+BLOCK_HOURS     = 36 # hours per block of a streamed run
+MAX_CACHED_DAYS = 16 # parsed 24HR_KP_AVG and AURORA_POWER day files a DriverArchive keeps
+
+MODES = ['timeobs', 'timederive', 'fixderive', 'fixall']
+
+Drivers = namedtuple('Drivers', ['kp', 'f107', 'f107d', 'kp_avg', 'swbt', 'swangle', 'swvel', 'swden', 'swbz',
+                                 'hemi_pow', 'hemi_pow_idx', 'swby'])
 
-def output_timestamp(start_date,delta=0):
-  return (datetime.datetime.strptime(start_date,'%Y-%m-%dT%H:%M:%SZ') + datetime.timedelta(minutes=delta)).strftime('%Y-%m-%dT%H:%M:%SZ')
+class DriverError(Exception):
+  pass
 
 def compare_create(start_date):
   return datetime.datetime.strptime(start_date,'%Y-%m-%dT%H:%M:%SZ').strftime('%Y%m%d%H')
@@ -32,8 +51,7 @@ def compare_create(start_date):
 
 def failure(fail_point):
   ## fail_point: string
-  print('error during '+fail_point)
-  exit(0)
+  raise DriverError('error during '+fail_point)
 
 ### YYYYMMDDHH functions
 
@@ -73,29 +91,114 @@ def get_dates(start,end):
 
 ### interpolation
 
-def interpolate(arr, mins_per_segment):
-  ## arr: array of values to linearly interpolate between
-  ## mins_per_segment: integer number of values per interpolation pair
-  output = [] # initialize
-  for pair in zip(arr, arr[1:]): # pair the values in the array
-    output = np.append(output, np.linspace(pair[0], pair[1], mins_per_segment+1)[:-1]) # take the linspace, dropping off the last value
-  output = np.append(output, arr[-1]) # add the last value
-  return output
+def resample(arr, mins_per_segment, start, count, interval=1):
+  ## arr: array of values spaced mins_per_segment minutes apart, arr[0] at minute 0
+  ## start: integer minute offset of the first output sample
+  ## count: integer number of output samples
+  ## interval: integer minutes between output samples
+  # linearly interpolate onto the output axis in one pass, samples beyond
+  # either end of arr hold the edge value
+  minutes = start + interval*np.arange(count)
+  return np.interp(minutes, mins_per_segment*np.arange(len(arr)), np.asarray(arr, dtype='float64'))
 
 ### parsing
 
-def get_f107d(dates):
+class KpApF107(object):
+  ## yearly KP_AP_F107 database, each <year> file is parsed once into
+  ## columnar arrays (daily F10.7, eight 3-hourly Kp per day) indexed by YYMMDD
+  def __init__(self, root, profiler=None):
+    self.root  = root
+    self.years = {}
+    self.profiler = profiler if profiler is not None else StageProfiler()
+
+  def load(self, year):
+    ## year: YYYY string
+    if year not in self.years:
+      index = {}
+      f107  = []
+      kp    = []
+      filename = path.join(self.root, 'KP_AP_F107', year)
+      size = 0
+      with open(filename) as file:
+        for line in file:
+          size += len(line)
+          if line[:6] in index: continue
+          try:
+            row_kp   = [float(line[i:i+2])/10 for i in range(12, 28, 2)]
+            row_f107 = float(line[65:71])
+          except ValueError:
+            continue
+          index[line[:6]] = len(f107)
+          kp.append(row_kp)
+          f107.append(row_f107)
+      self.profiler.count('get_kp_f107', 1, size)
+      self.years[year] = (index, np.array(f107), np.array(kp).reshape(-1, 8))
+    return self.years[year]
+
+  def row(self, cdate):
+    ## cdate: YYYYMMDD(HH) string
+    # returns (f107, kp[8]) for the day, or None if the day is not in the database.
+    # the year file is picked from cdate, so windows crossing a year boundary
+    # transparently load the neighbouring file
+    index, f107, kp = self.load(cdate[:4])
+    i = index.get(cdate[2:8])
+    if i is None:
+      return None
+    return f107[i], kp[i]
+
+class DriverArchive(object):
+  ## database of a run: the KP_AP_F107, 24HR_KP_AVG and AURORA_POWER trees
+  ## under path, and the fixed values file of the fix* modes. yearly files
+  ## are kept once parsed, day files for the last max_days days read
+  ## cache:    directory for binary sidecars of the AURORA_POWER files
+  ## profiler: StageProfiler credited with the files read
+  ## max_days: day files kept, None keeps every one
+  def __init__(self, path, cache=None, fixed='', profiler=None, max_days=MAX_CACHED_DAYS):
+    self.path     = path
+    self.cache    = cache
+    self.fixed    = fixed
+    self.max_days = max_days
+    self.profiler = profiler if profiler is not None else StageProfiler()
+    self.kp_ap_f107 = KpApF107(path, self.profiler)
+    self.days = OrderedDict() # filename -> parsed contents, least recently used first
+
+  def day_file(self, filename, read, stage):
+    ## filename: day file, read(filename) gives its parsed contents and the
+    ##           bytes read for them, unless they are already kept
+    ## stage:    profiler stage credited with the read
+    if filename in self.days:
+      self.days.move_to_end(filename)
+      return self.days[filename]
+    data, size = read(filename)
+    self.profiler.count(stage, 1, size)
+    self.days[filename] = data
+    if self.max_days is not None and len(self.days) > self.max_days:
+      self.days.popitem(last=False)
+    return data
+
+  def kp_avg_day(self, cdate):
+    ## cdate: YYYYMMDD(HH) string
+    return self.day_file(path.join(self.path, '24HR_KP_AVG', cdate[:4], kp_avg_date_fmt(cdate)),
+                         lambda filename: (read_kp_avg(filename), path.getsize(filename)), 'get_24hr_kp_avg')
+
+  def solar_day(self, cdate):
+    ## cdate: YYYYMMDD(HH) string
+    return self.day_file(path.join(self.path, 'AURORA_POWER', cdate[:4], hemi_date_fmt(cdate)),
+                         lambda filename: load_array(filename, read_hemi_input, self.cache), 'get_solar_data')
+
+def get_f107d(source, dates):
   f107 = []
   try:
     for cdate in dates:
-      with open(path.join(args.path, 'KP_AP_F107', cdate[:4])) as file:
-        f107.extend([float(line[65:71]) for line in file if line[:6] == hourless(cdate[2:])])
+      row = source.kp_ap_f107.row(cdate)
+      if row is not None:
+        f107.append(row[0])
   except:
     failure('f107d read')
 
   return np.mean(f107)
 
-def get_kp_f107(dates):
+def get_kp_f107(source, dates):
   ## start: YYYYMMDDHH string for starting date
   ## end:   YYYYMMDDHH string for ending date
   # initialize
@@ -103,81 +206,78 @@ def get_kp_f107(dates):
   f107  = []
   f107d = []
   try:
-    for cdate in dates:                                    # for each date to pull info for, open database file
-      f107d = np.append(f107d, get_f107d(get_dates(new_timestamp(cdate,-24*40),new_timestamp(cdate,24*40))))
-      with open(path.join(args.path, 'KP_AP_F107', cdate[:4])) as file:
-        f = file.readlines()
-        kp.extend([float(line[i:i+2])/10 for i in range(12, 28, 2) for line in f if line[:6] == hourless(cdate[2:])])
-        f107.extend([float(line[65:71])                            for line in f if line[:6] == hourless(cdate[2:])])
+    for cdate in dates:                                    # for each date to pull info for, look up the database
+      f107d.append(get_f107d(source, get_dates(new_timestamp(cdate,-24*40),new_timestamp(cdate,24*40))))
+      row = source.kp_ap_f107.row(cdate)
+      if row is not None:
+        f107.append(row[0])
+        kp.extend(row[1])
   except:
     failure('yearly kp_ap database read')
-  # return the interpolated values
-  return interpolate(np.array(kp), mins_per_kp_segment), interpolate(np.array(f107), mins_per_f107_segment), interpolate(np.array(f107d), mins_per_f107_segment)
+  source.profiler.count('get_kp_f107', records=len(kp))
+  # return the per-segment values, parse() resamples them
+  return np.array(kp), np.array(f107), np.array(f107d)
 
 def kp_avg_date_fmt(date):
    return date[:4] + '_doy' + "{:03d}".format(doy(date)) + '_avgkp.dat'
 
-def get_24hr_kp_avg(dates):
-  kp_avg = []
+def read_kp_avg(filename):
+  # 24HR_KP_AVG daily file: one line per minute ending in the 24hr-avg Kp
+  with open(filename) as file:
+    return np.array([float(line.rstrip()[-10:]) for line in file])
+
+def get_24hr_kp_avg(source, dates):
   try:
-    for cdate in dates:
-      with open(path.join(args.path, '24HR_KP_AVG', cdate[:4], kp_avg_date_fmt(cdate))) as file:
-        for line in file:
-          kp_avg = np.append(kp_avg,float(line.rstrip()[-10:]))
+    kp_avg = np.concatenate([source.kp_avg_day(cdate) for cdate in dates])
   except:
     failure('24hr_kp_avg database read')
+  source.profiler.count('get_24hr_kp_avg', records=len(kp_avg))
 
   return kp_avg
 
 def hemi_date_fmt(date):
   return datetime.datetime.strptime(date,'%Y%m%d%H').strftime('%Y-%m-%d') + '-input.txt'
 
-def get_solar_data(dates):
-  swbt         = []
-  swangle      = []
-  swvel        = []
-  swden        = []
-  bz           = []
-  hemi_pow     = []
-  hemi_pow_idx = []
+def read_hemi_input(filename):
+  # AURORA_POWER daily file: 95 header lines, then one row of solar wind and
+  # hemispheric power columns per minute
+  return np.loadtxt(filename, skiprows=95, ndmin=2)
 
+def get_solar_data(source, dates):
   try:
-    for cdate in dates:
-      with open(path.join(args.path, 'AURORA_POWER', cdate[:4], hemi_date_fmt(cdate))) as file:
-        lines = np.array([[float(i) for i in line.split(' ')] for line in file.readlines()[95:]])
-        swbt.extend(   lines[:,0])
-        swangle.extend(lines[:,1])
-        swvel.extend(  lines[:,3])
-        swden.extend(  lines[:,4])
-        bz.extend(     lines[:,5])
-        hemi_pow.extend(lines[:,-1])
-        hemi_pow_idx.extend(lines[:,-2])
+    lines = np.concatenate([source.solar_day(cdate) for cdate in dates])
   except Exception as e:
     print(str(e))
     failure('hemispheric power read')
-  
-  return np.array(swbt),  np.array(swangle), np.array(swvel), \
-         np.array(swden), np.array(bz),      np.array(hemi_pow), np.array(hemi_pow_idx, dtype=int)
+  source.profiler.count('get_solar_data', records=len(lines))
 
-def start_fixed_data(mduration):
+  return lines[:,0], lines[:,1], lines[:,3], lines[:,4], lines[:,5], lines[:,-1], lines[:,-2].astype(int)
+
+def start_fixed_data(source, count):
   # read f107, kp
-  with open(args.fixed,'r') as f:
+  with open(source.fixed,'r') as f:
     lines = f.read().splitlines()
-    return np.ones(mduration)*float(lines[0]), np.ones(mduration)*float(lines[1])
+    return np.ones(count)*float(lines[0]), np.ones(count)*float(lines[1])
 
-def finish_fixed_data(mduration):
+def finish_fixed_data(source, count):
   # read swvel, swden, swby, swbz, gwatts, HPI
-  with open(args.fixed,'r') as f:
+  with open(source.fixed,'r') as f:
     lines = f.read().splitlines()
-    return np.ones(mduration)*float(lines[2]), np.ones(mduration)*float(lines[3]), \
-           np.ones(mduration)*float(lines[4]), np.ones(mduration)*float(lines[5]), \
-           np.ones(mduration)*float(lines[6]), np.ones(mduration)*float(lines[7])
+    return np.ones(count)*float(lines[2]), np.ones(count)*float(lines[3]), \
+           np.ones(count)*float(lines[4]), np.ones(count)*float(lines[5]), \
+           np.ones(count)*float(lines[6]), np.ones(count)*float(lines[7])
 
-def parse(start_date, end_date, hduration):
+def parse(source, start_date, end_date, hduration, mode='timeobs', interval=1, fill=(66.0, 66.0)):
+  ## source:     DriverArchive to read from
   ## start_date: YYYYMMDDHH string
   ## end_date:   YYYYMMDDHH string
-  ## hduration:  integer hours to forecast, convert immediately to minutes+1 mduration
-  mduration = hduration*60+1
+  ## hduration:  integer hours to forecast, converted to count samples at interval minutes
+  ## mode:       one of MODES
+  ## interval:   integer minutes between output samples
+  ## fill:       F10.7 and 41-day F10.7 replacing capped values at start_date,
+  ##             the last values before it when a run is built in blocks
+  profiler = source.profiler
+  count = hduration*60//interval+1
 
   starting_min = float(start_date[-2:])*60
   ending_min   = float(end_date[-2:]  )*60
@@ -195,237 +295,191 @@ def parse(start_date, end_date, hduration):
     max_f107 = end_date
 
   # KP/F107
-  if args.mode[:4] == 'time':
+  if mode[:4] == 'time':
     kp_offset     = time_diff(start_date+'00', hourless(min_f107) + kp_midpoint_string)
     f107_offset   = time_diff(start_date+'00', hourless(min_f107) + f107_midpoint_string)
     kp_avg_offset = time_diff(start_date+'00', hourless(start_date) + '0000')
-    kp, f107, f107d = get_kp_f107(get_dates(min_f107, max_f107))
-    kp_avg          = get_24hr_kp_avg(get_dates(start_date,end_date))
+    with profiler.stage('get_kp_f107'):
+      kp, f107, f107d = get_kp_f107(source, get_dates(min_f107, max_f107))
+    kp     = resample(kp,     mins_per_kp_segment,   kp_offset,     count, interval)
+    f107   = resample(f107,   mins_per_f107_segment, f107_offset,   count, interval)
+    f107d  = resample(f107d,  mins_per_f107_segment, f107_offset,   count, interval)
+    with profiler.stage('get_24hr_kp_avg'):
+      kp_avg = get_24hr_kp_avg(source, get_dates(start_date,end_date))
+    kp_avg = resample(kp_avg, 1, kp_avg_offset, count, interval)
   else: # fixed kp/f107
-    kp_offset     = 0
-    f107_offset   = 0
     kp_avg_offset = 0
-    f107, kp = start_fixed_data(mduration)
+    f107, kp = start_fixed_data(source, count)
     kp_avg = kp ; f107d = f107 # 24hr avg kp = kp, f10.7 daily = f10.7
-  f107  = cap_min_max(f107,66,True)
-  f107d = cap_min_max(f107d,66,True)
+  f107  = cap_min_max(f107,66,True,fill[0])
+  f107d = cap_min_max(f107d,66,True,fill[1])
   # SOLAR WIND DATA
-  if args.mode[-6:] != 'derive': # either timeobs (equation) or fixall (0)
-    hemi_offset = kp_avg_offset
-    if args.mode[-3:] == 'obs': # get solar data from obs
-      swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx = get_solar_data(get_dates(start_date,end_date))
+  if mode[-6:] != 'derive': # either timeobs (equation) or fixall (0)
+    if mode[-3:] == 'obs': # get solar data from obs, stored at 1-minute cadence
+      with profiler.stage('get_solar_data'):
+        solar_data = get_solar_data(source, get_dates(start_date,end_date))
+      swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx = \
+        [resample(arr, 1, kp_avg_offset, count, interval) for arr in solar_data]
+      hemi_pow_idx = hemi_pow_idx.astype(int)
     else: # values are fixed from input
-      swvel, swden, swby, swbz, hemi_pow, hemi_pow_idx = finish_fixed_data(mduration)
+      swvel, swden, swby, swbz, hemi_pow, hemi_pow_idx = finish_fixed_data(source, count)
       swbt = np.sqrt(swby**2 + swbz**2)
       swangle = np.arcsin(swby/swbt)/math.pi*180
   else: # use Tim's algorithms: https://github.com/SWPC-IPE/WAM-IPE/issues/126#issuecomment-374304207
-    hemi_offset = 0
-    swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx = calc_solar_data(kp[kp_offset:kp_offset+mduration], f107[f107_offset:f107_offset+mduration])
+    swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx = calc_solar_data(kp, f107)
 
-  # return our subarrays
-  return kp[kp_offset:kp_offset+mduration], f107[f107_offset:f107_offset+mduration], f107d[f107_offset:f107_offset+mduration], \
-         kp_avg[kp_avg_offset:kp_avg_offset+mduration], swbt[hemi_offset:hemi_offset+mduration], \
-         swangle[hemi_offset:hemi_offset+mduration], swvel[hemi_offset:hemi_offset+mduration], \
-         swden[hemi_offset:hemi_offset+mduration], swbz[hemi_offset:hemi_offset+mduration], \
-         hemi_pow[hemi_offset:hemi_offset+mduration], hemi_pow_idx[hemi_offset:hemi_offset+mduration]
+  return kp, f107, f107d, kp_avg, swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx
 
 ### output
 
-def output_timestamp(start_date,delta=0):
-  return (datetime.datetime.strptime(start_date,'%Y%m%d%H') + datetime.timedelta(minutes=delta)).strftime('%Y-%m-%dT%H:%M:%SZ')
-
-def txt_output(file, kp, f107, f107d, kpa, swbt, swangle, swvel, swbz, hemi_pow, hemi_pow_idx, swden, swby, date, coupled=True):
-    def running_average(arr):
-      vals = np.asarray(arr,dtype='float64')
-      output = np.zeros(len(vals)+AVERAGING_INTERVAL,dtype='float64')
-      output[AVERAGING_INTERVAL:] = vals
-      output[:AVERAGING_INTERVAL] = np.ones(AVERAGING_INTERVAL)*vals[0]
-      cumsum_vec = np.cumsum(np.insert(output, 0, 0))
-      return ((cumsum_vec[AVERAGING_INTERVAL:] - cumsum_vec[:-AVERAGING_INTERVAL])/AVERAGING_INTERVAL)[1:]
-
-    swbzo = running_average(swbz)
-    swbyo = running_average(swby)
-    swdeo = running_average(swden)
-    swveo = running_average(swvel)
-    print(swbyo, swbzo)
-    swang = swang_calc(swbyo, swbzo)
-    swbt  = swbt_calc(swbyo, swbzo)
-
-    f = open(file,'w')
-    f.write('Issue Date          \n')
-    f.write('Flags:  0=Forecast, 1=Estimated, 2=Observed \n\n')
-
-    f.write(" Date_Time                   F10          Kp     F10Flag      KpFlag  F10_41dAvg   24HrKpAvg    NHemiPow NHemiPowIdx    SHemiPow SHemiPowIdx       SW_Bt    SW_Angle SW_Velocity       SW_Bz      SW_Den   \n")
-    f.write("--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------   \n")
-
-    write_output = False
-
-    for i in range(0,len(kp)):
-      if not write_output:
-        write_output = compare_timestamp(args.start_date,output_timestamp(date[0],i))
-        if write_output: flip = i
-      if write_output:
-        f.write("{0}{1:>12.7f}{2:>12.7f}{3:>12}{4:>12}{5:>12.7f}{6:>12.7f}{7:>12.7f}{8:>12}{9:>12.7f}{10:>12}{11:>12.7f}{12:>12.7f}{13:>12.7f}{14:>12.7f}{15:>12.7f}\n".format( \
-                 output_timestamp(date[0],i), \
-                 f107[i],                     \
-                 kp[i],                       \
-                 '2','1',                     \
-                 f107d[i],                    \
-                 kpa[i],                      \
-                 hemi_pow[i],                 \
-                 hemi_pow_idx[i],             \
-                 hemi_pow[i],                 \
-                 hemi_pow_idx[i],             \
-                 swbt[i],                     \
-                 swang[i],                    \
-                 swveo[i],                    \
-                 swbzo[i],                    \
-                 swdeo[i]))
-
-    for i in range(len(kp),args.duration*60+flip):
-      f.write("{0}{1:>12.7f}{2:>12.7f}{3:>12}{4:>12}{5:>12.7f}{6:>12.7f}{7:>12.7f}{8:>12}{9:>12.7f}{10:>12}{11:>12.7f}{12:>12.7f}{13:>12.7f}{14:>12.7f}{15:>12.7f}\n".format( \
-               output_timestamp(date[0],i), \
-               f107[-1],                    \
-               kp[-1],                      \
-               '2','1',                     \
-               f107d[-1],                   \
-               kpa[-1],                     \
-               hemi_pow[-1],                \
-               hemi_pow_idx[-1],            \
-               hemi_pow[-1],                \
-               hemi_pow_idx[-1],            \
-               swbt[-1],                    \
-               swang[-1],                   \
-               swveo[-1],                   \
-               swbzo[-1],                   \
-               swdeo[-1]))
-
-
-def netcdf_output(file, kp, f107, f107d, kp_avg, swbt, swangle, swvel, swbz, hemi_pow, hemi_pow_idx, swden, swby, coupled=True):
-  def running_average(arr):
-    vals = np.asarray(arr,dtype='float64')
-    output = np.zeros(len(vals)+AVERAGING_INTERVAL,dtype='float64')
-    output[AVERAGING_INTERVAL:] = vals
-    output[:AVERAGING_INTERVAL] = np.ones(AVERAGING_INTERVAL)*vals[0]
-    cumsum_vec = np.cumsum(np.insert(output, 0, 0))
-    return ((cumsum_vec[AVERAGING_INTERVAL:] - cumsum_vec[:-AVERAGING_INTERVAL])/AVERAGING_INTERVAL)[1:]
-
-  def ap_from_kp(kp, kpa):
-    ap  = kp.copy()
-    apd = kpa.copy()
-
-    for i,v in enumerate(ap):
-      lookup = v*3
-      remainder = lookup - int(lookup)
-      ap[i]  = (1 - remainder) * LOOKUP_TABLE[int(lookup)] + \
-                    remainder  * LOOKUP_TABLE[int(lookup) + 1]
-    for i,v in enumerate(apd):
-      lookup = v*3
-      remainder = lookup - int(lookup)
-      apd[i] = (1 - remainder) * LOOKUP_TABLE[int(lookup)] + \
-                    remainder  * LOOKUP_TABLE[int(lookup) + 1]
-    return ap, apd
-
-  swbzo = running_average(swbz)
-  swbyo = running_average(swby)
-  swdeo = running_average(swden)
-  swveo = running_average(swvel)
-  swang = swang_calc(swbyo, swbzo)
-  swbt  = swbt_calc(swbyo, swbzo)
-
-  _mode = 'w'
-
-  ap, apd = ap_from_kp(kp, kp_avg)
-
-  _fields = lambda k: [f107[k], kp[k], f107d[k], kp_avg[k],
-                       hemi_pow[k], hemi_pow_idx[k], hemi_pow[k], hemi_pow_idx[k],
-                       swbt[k], swang[k], swveo[k], swbzo[k],
-                       swdeo[k], ap[k], apd[k]]
-  # Open
-  _o = Dataset(file, _mode, format='NETCDF3_64BIT_OFFSET')
-  _vars = []
+def solar_wind_averages(averages, swbz, swby, swden, swvel):
+  ## averages: RollingMean of swbz, swby, swden and swvel
+  # averaged swbz, swby, swden, swvel, and the swang and swbt they give
+  swbzo, swbyo, swdeo, swveo = [avg.append(arr) for avg, arr in zip(averages, [swbz, swby, swden, swvel])]
+  return swbzo, swbyo, swdeo, swveo, swang_calc(swbyo, swbzo), swbt_calc(swbyo, swbzo)
 
-  if coupled:
-    _o.skip = 36*60
-  else:
-    _o.skip = 0
-
-  _o.ifp_interval = 60
-
-  # Dimensions
-  t_dim = _o.createDimension('time',  None)
-  t_var = _o.createVariable('time', 'i4', ('time',))
-  t_var.units     = 'minutes'
-
-  # Variables
-  for i in range(len(VAR_NAMES)):
-    _vars.append(_o.createVariable(VAR_NAMES[i], VAR_TYPES[i], ('time',)))
-    if VAR_UNITS[i] is not None:
-      _vars[-1].units = VAR_UNITS[i]
-
-  # Output
-  _start = len(t_var[:])
-  _len = len(f107)
-  _output_fields = []
-
-  for i in range(_len):
-    _output_fields.append(_fields(i))
-  _output_arr = np.asarray(_output_fields)
-
-  for i, var in enumerate(_vars):
-    var[_start:_start+_len] = _output_arr[:,i]
-
-  _o.close()
-
-
-LOOKUP_TABLE = [   0,   2,   3,   4,   5,   6,   7,   9,  12,  15,
-                  18,  22,  27,  32,  39,  48,  56,  67,  80,  94,
-                 111, 132, 154, 179, 207, 236, 300, 400, 999 ]
-VAR_NAMES = [ 'f107', 'kp', 'f107d', 'kpa', 'nhp', 'nhpi', 'shp', 'shpi', 'swbt',
-                   'swang', 'swvel', 'swbz', 'swden', 'ap', 'apa' ]
-VAR_TYPES = [ 'f4', 'f4', 'f4', 'f4', 'f4', 'i2', 'f4', 'i2', 'f4',
-              'f4', 'f4', 'f4', 'f4', 'f4', 'f4' ]
-VAR_LONG_NAMES = [ '10.7cm Solar Radio Flux' , 'Kp Index', '41-Day F10.7 Average', '24hr Kp Average',
-                   'Northern Hemispheric Power', 'Northern Hemispheric Power Index',
-                   'Southern Hemispheric Power', 'Southern Hemispheric Power Index',
-                   'IMF Total B Strength', 'Solar Wind Angle', 'Solar Wind Velocity',
-                   'IMF Bz Strength', 'Solar Wind Density', 'Ap Index', '24hr Ap Average' ]
-VAR_UNITS = [ 'sfu', None, 'sfu', None, 'GW', None, 'GW', None,
-              'nT', 'degrees', 'm/s', 'nT', 'cm^-3', None, None ]
-### main function
+def txt_header(f):
+  f.write('Issue Date          \n')
+  f.write('Flags:  0=Forecast, 1=Estimated, 2=Observed \n\n')
 
-def run(start_date, duration, output_filename):
-  end_date = new_timestamp(start_date, duration)
-  kp, f107, f107d, kp_avg, swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx = parse(start_date, end_date, duration)
-  swby = swbt * np.sin(swangle*math.pi/180)
-  netcdf_output(output_filename, kp, f107, f107d, kp_avg, swbt, swangle, swvel, swbz, hemi_pow, hemi_pow_idx, swden, swby)
-  txt_output('wam_input_f107_kp.txt', kp, f107, f107d, kp_avg, swbt, swangle, swvel, swbz, hemi_pow, hemi_pow_idx, swden, swby, get_dates(new_timestamp(start_date,0),end_date))
+  f.write(" Date_Time                   F10          Kp     F10Flag      KpFlag  F10_41dAvg   24HrKpAvg    NHemiPow NHemiPowIdx    SHemiPow SHemiPowIdx       SW_Bt    SW_Angle SW_Velocity       SW_Bz      SW_Den   \n")
+  f.write("--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------   \n")
 
-### we start below
+def netcdf_fields(time, kp, f107, f107d, kp_avg, hemi_pow, hemi_pow_idx, swbt, swang, swveo, swbzo, swdeo):
+  return { 'time' : time,
+           'f107' : f107,     'kp'   : kp,           'f107d' : f107d,    'kpa'   : kp_avg,
+           'nhp'  : hemi_pow, 'nhpi' : hemi_pow_idx, 'shp'   : hemi_pow, 'shpi'  : hemi_pow_idx,
+           'swbt' : swbt,     'swang': swang,        'swvel' : swveo,    'swbz'  : swbzo,
+           'swden': swdeo,    'ap'   : ap_from_kp(kp), 'apa' : ap_from_kp(kp_avg) }
 
-## parsing options
-parser = ArgumentParser(description='Parse KP, F10.7, 24hr average Kp, and hemispheric power files into binned data', formatter_class=ArgumentDefaultsHelpFormatter)
-parser.add_argument('-i', '--interval',   help='interval length (minutes) (default=1)', type=int, default=1) # this feature doesn't work yet
-parser.add_argument('-d', '--duration',   help='duration of run (hours) (default=24)',  type=int, default=24)
-parser.add_argument('-s', '--start_date', help='starting date of run (YYYYMMDDhh)',     type=str, required=True)
-parser.add_argument('-p', '--path',       help='path to database files',                type=str, required=True)
-parser.add_argument('-o', '--output',     help='path to output file',                   type=str, default='input_parameters.nc')
-parser.add_argument('-m', '--mode', help='timeobs (time-varying from obs), timederive (time-varying kp/f10.7, derived solar wind drivers), '+\
-                                         'fixderive (fixed kp/f10.7, derived solar wind drivers), or fixall (everything fixed)', type=str, default='timeobs')
-parser.add_argument('-f', '--fixed', help='full path to file containing fixed data for run', type=str, default='')
+def netcdf_attrs(coupled, interval):
+  if coupled:
+    skip = 36*60//interval
+  else:
+    skip = 0
+  return { 'skip' : skip, 'ifp_interval' : 60*interval }
+
+def stream_output(blocks, start_date, output_filename, txt_filename, profiler=None, coupled=True, interval=1, nc_format=NC_FORMAT, chunk=NC_CHUNK):
+  ## blocks:    (sample offset, Drivers) from build_blocks
+  ## nc_format: one of NC_FORMATS for input_parameters.nc
+  ## chunk:     samples per NETCDF4 chunk
+  # write each block to both files as it comes, averaging across blocks, so
+  # only one block is held at a time
+  profiler = profiler if profiler is not None else StageProfiler()
+  averages = [RollingMean(averaging_window(interval)) for i in range(4)]
+  start    = epoch_minutes(datetime.datetime.strptime(start_date,'%Y%m%d%H'))
+  with NetcdfWriter(output_filename, sync_every=0, format=nc_format, chunk=chunk) as nc, open(txt_filename,'w') as f:
+    txt_header(f)
+    for offset, d in blocks:
+      swbzo, swbyo, swdeo, swveo, swang, swbt = solar_wind_averages(averages, d.swbz, d.swby, d.swden, d.swvel)
+      samples = interval*(offset + np.arange(len(d.kp)))
+      with profiler.stage('netcdf_output'):
+        nc.write(netcdf_fields(samples, d.kp, d.f107, d.f107d, d.kp_avg, d.hemi_pow, d.hemi_pow_idx,
+                               swbt, swang, swveo, swbzo, swdeo),
+                 netcdf_attrs(coupled, interval))
+      profiler.count('netcdf_output', records=len(d.kp))
+      with profiler.stage('txt_output'):
+        write_txt_rows(f, start + samples, [d.f107, d.kp, d.f107d, d.kp_avg, d.hemi_pow, d.hemi_pow_idx, d.hemi_pow, d.hemi_pow_idx,
+                                            swbt, swang, swveo, swbzo, swdeo])
+      profiler.count('txt_output', records=len(d.kp))
+
+def averaging_window(interval):
+  ## interval: integer minutes between samples
+  # number of samples spanning the solar wind averaging_mins
+  return max(1, averaging_mins//interval)
 
-## global variables
-args = parser.parse_args()
+### main function
 
-mins_per_kp_segment    = 3*60
-mins_per_f107_segment  = 24*60
-midpoint_f107          = 15*60
-midpoint_f107_fraction = float(midpoint_f107)/mins_per_f107_segment
-f107_midpoint_string   = '1500'
-kp_midpoint_string     = '0130'
-averaging_mins         = 20
-AVERAGING_INTERVAL = averaging_mins
-offset         = 20
+def build_drivers(start_date, duration, mode, source, interval=1, fill=(66.0, 66.0)):
+  ## start_date: YYYYMMDDHH string
+  ## duration:   integer hours of the run
+  ## mode:       one of MODES
+  ## source:     DriverArchive to read from
+  ## interval:   integer minutes between samples
+  ## fill:       see parse
+  # Drivers of the duration*60//interval+1 samples from start_date
+  if mode not in MODES:
+    raise ValueError('mode must be one of {}'.format(', '.join(MODES)))
+  if interval < 1 or (36*60) % interval:
+    raise ValueError('interval must be a positive divisor of {} minutes'.format(36*60))
+  with source.profiler.stage('parse'):
+    kp, f107, f107d, kp_avg, swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx = \
+      parse(source, start_date, new_timestamp(start_date, duration), duration, mode, interval, fill)
+  source.profiler.count('parse', records=len(kp))
+  swby = swbt * np.sin(swangle*math.pi/180)
+  return Drivers(kp, f107, f107d, kp_avg, swbt, swangle, swvel, swden, swbz, hemi_pow, hemi_pow_idx, swby)
+
+def build_blocks(start_date, duration, mode, source, interval=1, block_hours=BLOCK_HOURS):
+  ## block_hours: integer hours per block, block_hours*60 a multiple of interval
+  # (sample offset, Drivers) of consecutive blocks of the run, together the
+  # same samples as build_drivers(start_date, duration, ...) gives at once
+  if (block_hours*60) % interval or block_hours < 1:
+    raise ValueError('block_hours must be a positive multiple of interval')
+  hours = 0
+  fill  = (66.0, 66.0)
+  while True:
+    block = min(block_hours, duration - hours)
+    last  = hours + block >= duration
+    drivers = build_drivers(new_timestamp(start_date, hours), block, mode, source, interval, fill)
+    if not last:
+      # the block's end sample is the first of the next
+      drivers = Drivers(*[arr[:-1] for arr in drivers])
+    yield hours*60//interval, drivers
+    if last:
+      return
+    fill   = (drivers.f107[-1], drivers.f107d[-1])
+    hours += block
+
+def write_drivers(drivers, start_date, output_filename, txt_filename='wam_input_f107_kp.txt', profiler=None, interval=1, nc_format=NC_FORMAT):
+  ## drivers:  Drivers from build_drivers(start_date, ...)
+  ## output_filename, txt_filename: input_parameters.nc and text output
+  # written as a single block, so the averages are computed once for both files
+  stream_output([(0, drivers)], start_date, output_filename, txt_filename, profiler, interval=interval, nc_format=nc_format)
+
+def run(start_date, duration, output_filename, mode, source, interval=1, txt_filename='wam_input_f107_kp.txt', block_hours=None, nc_format=NC_FORMAT):
+  ## block_hours: build and write the run in blocks of this many hours, with
+  ##              memory bounded by the block rather than the run. None
+  ##              builds it at once and returns its Drivers
+  ## nc_format:   one of NC_FORMATS, NETCDF4 is chunked in whole blocks
+  if block_hours is not None:
+    stream_output(build_blocks(start_date, duration, mode, source, interval, block_hours),
+                  start_date, output_filename, txt_filename, source.profiler, interval=interval,
+                  nc_format=nc_format, chunk=chunk_records(block_hours*60//interval))
+    source.profiler.flush(start_date)
+    return None
+  drivers = build_drivers(start_date, duration, mode, source, interval)
+  write_drivers(drivers, start_date, output_filename, txt_filename, source.profiler, interval, nc_format)
+  source.profiler.flush(start_date)
+  return drivers
+
+def main():
+  parser = ArgumentParser(description='Parse KP, F10.7, 24hr average Kp, and hemispheric power files into binned data', formatter_class=ArgumentDefaultsHelpFormatter)
+  parser.add_argument('-i', '--interval',   help='interval length (minutes), must divide 36 hours', type=int, default=1)
+  parser.add_argument('-d', '--duration',   help='duration of run (hours) (default=24)',  type=int, default=24)
+  parser.add_argument('-s', '--start_date', help='starting date of run (YYYYMMDDhh)',     type=str, required=True)
+  parser.add_argument('-p', '--path',       help='path to database files',                type=str, required=True)
+  parser.add_argument('-o', '--output',     help='path to output file',                   type=str, default='input_parameters.nc')
+  parser.add_argument('-m', '--mode', help='timeobs (time-varying from obs), timederive (time-varying kp/f10.7, derived solar wind drivers), '+\
+                                           'fixderive (fixed kp/f10.7, derived solar wind drivers), or fixall (everything fixed)', type=str, default='timeobs', choices=MODES)
+  parser.add_argument('-f', '--fixed', help='full path to file containing fixed data for run', type=str, default='')
+  parser.add_argument('-c', '--cache', help='directory for binary sidecars of the AURORA_POWER files (no caching if unset)', type=str, default=None)
+  parser.add_argument('-b', '--block_hours', help='build and write the run in blocks of this many hours to bound memory, 0 for all at once', type=int, default=0)
+  parser.add_argument('-l', '--profile_log', help='append per-stage timings of the run to this JSON-lines file', type=str, default=None)
+  parser.add_argument('-P', '--cprofile',    help='dump cProfile stats of the run to this file', type=str, default=None)
+  parser.add_argument('-F', '--nc_format',   help='format of input_parameters.nc', type=str, default=NC_FORMAT, choices=NC_FORMATS)
+
+  args = parser.parse_args()
+  if args.interval < 1 or (36*60) % args.interval:
+    parser.error('--interval must be a positive divisor of {} minutes'.format(36*60))
+
+  profiler = StageProfiler(args.profile_log, args.cprofile)
+  try:
+    run(args.start_date, args.duration, args.output, args.mode, DriverArchive(args.path, args.cache, args.fixed, profiler), args.interval,
+        block_hours=args.block_hours or None, nc_format=args.nc_format)
+  except DriverError as e:
+    print(str(e))
+  finally:
+    profiler.close()
 
-## __MAIN__
-run(args.start_date, args.duration, args.output)
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,26 @@
+import numpy as np
+
+# Kp <-> Ap conversion shared by interpolate_input_parameters.py and
+# parse_realtime.py. Kp is stepped in thirds, so LOOKUP_TABLE[i] is the Ap
+# for Kp = i/3, and values in between are linearly interpolated.
+
+LOOKUP_TABLE = np.array([   0,   2,   3,   4,   5,   6,   7,   9,  12,  15,
+                           18,  22,  27,  32,  39,  48,  56,  67,  80,  94,
+                          111, 132, 154, 179, 207, 236, 300, 400, 999 ], dtype='float64')
+KP_TABLE_MAX = (len(LOOKUP_TABLE) - 1) / 3.
+AP_TABLE_MAX = LOOKUP_TABLE[-1]
+
+def ap_from_kp(kp):
+    # kp: scalar or array, clamped to [0, KP_TABLE_MAX], NaN stays NaN
+    lookup = np.clip(np.asarray(kp, dtype='float64')*3, 0, len(LOOKUP_TABLE) - 1)
+    idx = np.minimum(np.floor(np.nan_to_num(lookup)).astype(int), len(LOOKUP_TABLE) - 2)
+    remainder = lookup - idx
+    return (1 - remainder) * LOOKUP_TABLE[idx] + \
+                remainder  * LOOKUP_TABLE[idx + 1]
+
+def kp_from_ap(ap):
+    # ap: scalar or array, clamped to [0, AP_TABLE_MAX], NaN stays NaN
+    ap = np.clip(np.asarray(ap, dtype='float64'), 0, AP_TABLE_MAX)
+    # first table entry above ap, the top entry maps to KP_TABLE_MAX
+    idx = np.clip(np.searchsorted(LOOKUP_TABLE, ap, side='right'), 1, len(LOOKUP_TABLE) - 1)
+    return ((ap - LOOKUP_TABLE[idx-1])/(LOOKUP_TABLE[idx]-LOOKUP_TABLE[idx-1]) + idx - 1) / 3
@@ -3,16 +3,19 @@ from __future__ import print_function
 import xml.etree.ElementTree as ET
 import sys
 from sw_from_f107_kp import *
+from driver_output import VAR_NAMES, NC_FORMAT, NC_FORMATS, epoch_minutes, write_txt_rows, chunk_records, NetcdfWriter
+from kp_ap import ap_from_kp, kp_from_ap
+from timeseries import TimeSeries
+from file_cache import RecordCache
+from profiling import StageProfiler, profiled
 import numpy as np
 from datetime import datetime, timedelta
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from collections import defaultdict
-from math import exp
 import glob
 from matplotlib import pyplot as plt
-from collections import OrderedDict as od
-from netCDF4 import Dataset, date2num
 import traceback
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from os.path import basename
 
 # interpolate linearly between good values, only use decay on
@@ -37,68 +40,62 @@ DEFAULT_PATH = '.'
 DEFAULT_NAME = 'input_parameters.nc'
 MAX_WAIT = 120 # minutes
 EDATE = '999901010000'
-
-def backwards_search(dict,search_time,relax_func):
-    # relax_func takes an argument of the current time
-    for i in range(1,MAX_SEARCH_DIST+1):
-        st = search_time - timedelta(minutes=1)
-        if st in dict:
-            fac = exp(-i/TIME_CONSTANT)
-            return relax_func(search_time) * (1-fac) + dict[st] * fac
-    return relax_func(search_time)
-
-class InputParameter(object):
-    def __init__(self, search_func):
-        self.dict = {}
-        self.mean = None
-        if isinstance(search_func, str) and search_func == 'self_avg':
-            self.backwards_search = lambda dict, search_time: backwards_search(dict, search_time, lambda x: self.nanmean())
-        else:
-            self.backwards_search = lambda dict, search_time: backwards_search(dict, search_time, search_func)
-
-    def values(self):
-        return np.asarray(list(self.dict.values()))
-
-    def nanmean(self):
-        if self.mean is None:
-            self.mean = np.nanmean(self.values())
-        return self.mean
-
-    def running_average(self, averaging_time):
-        vals = np.asarray(list(self.dict.values()),dtype='float64')
-        output = np.zeros(len(vals)+averaging_time,dtype='float64')
-        output[averaging_time:] = vals
-        output[:averaging_time] = np.ones(averaging_time)*vals[0]
-        cumsum_vec = np.cumsum(np.insert(output, 0, 0))
-        return dict(zip(self.dict.keys(), ((cumsum_vec[averaging_time:] - cumsum_vec[:-averaging_time])/averaging_time)[1:]))
-
-class key_dependent_dict(defaultdict):
-    def __init__(self, f_of_x, factory=iter([])):
-        super().__init__(None, factory)
-        self.f_of_x = f_of_x
-    def __missing__(self, key):
-        ret = self.f_of_x(self, key)
-        self[key] = ret
-        return ret
+GEOSPACE_TAGS = ('mag_bz_gsm', 'mag_bx_gsm', 'mag_by_gsm', 'proton_density', 'proton_speed')
+
+def read_geospace_input(file):
+    # GEOSPACE_TAGS of the first data-item, stops reading once it closes
+    values = {}
+    with open(file, 'rb') as f:
+        for event, elem in ET.iterparse(f):
+            if elem.tag in GEOSPACE_TAGS:
+                values.setdefault(elem.tag, float(elem.text))
+            elif elem.tag == 'data-item':
+                break
+    return [values[tag] for tag in GEOSPACE_TAGS]
+
+def read_wam_input(file):
+    # (name, time, value) for each value of a wam_input file in file order,
+    # whether the whole file was read and its size. values before a bad one
+    # are kept
+    items = []
+    size  = 0
+    try:
+        size = os.path.getsize(file)
+        root = ET.parse(file).getroot()
+        time = datetime.strptime(root.find('data-item').get('time-tag'), WAM_INPUT_FMT)
+        for child in root.findall('data-item'):
+            time = datetime.strptime(child.get('time-tag'), WAM_INPUT_FMT)
+            if time.hour == 12:
+                items.append(('f107',  time, max(float(child.find('f10').text), F107_MIN)))
+                items.append(('f107a', time, max(float(child.find('f10-41-avg').text), F107A_MIN)))
+            items.append(('kp',  time, min(float(child.find('kp').text), KP_MAX)))
+            items.append(('kpa', time, min(float(child.find('kp-24-hr-avg').text), KPA_MAX)))
+        return items, True, size
+    except:
+        return items, False, size
+
+class SerialPool(object):
+    # runs each job as it is submitted, in place of a thread pool
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+class InputParameter(TimeSeries):
+    def __init__(self, relax_func):
+        # relax_func takes the start datetime and minute count of a window and
+        # gives the values to relax toward over it, or is 'self_avg' to relax
+        # toward the mean of the stored values
+        super().__init__()
+        if isinstance(relax_func, str) and relax_func == 'self_avg':
+            relax_func = lambda t, n: self.nanmean()
+        self.relax_func = relax_func
 
 class InputParameters(object):
-    _lookup_table = [   0,   2,   3,   4,   5,   6,   7,   9,  12,  15,
-                       18,  22,  27,  32,  39,  48,  56,  67,  80,  94,
-                      111, 132, 154, 179, 207, 236, 300, 400, 999 ]
-
-    _var_names = [ 'f107', 'kp', 'f107d', 'kpa', 'nhp', 'nhpi', 'shp', 'shpi', 'swbt',
-                   'swang', 'swvel', 'swbz', 'swden', 'ap', 'apa' ]
-    _var_types = [ 'f4', 'f4', 'f4', 'f4', 'f4', 'i2', 'f4', 'i2', 'f4',
-                   'f4', 'f4', 'f4', 'f4', 'f4', 'f4' ]
-    _var_long_names = [ '10.7cm Solar Radio Flux' , 'Kp Index', '41-Day F10.7 Average', '24hr Kp Average',
-                        'Northern Hemispheric Power', 'Northern Hemispheric Power Index',
-                        'Southern Hemispheric Power', 'Southern Hemispheric Power Index',
-                        'IMF Total B Strength', 'Solar Wind Angle', 'Solar Wind Velocity',
-                        'IMF Bz Strength', 'Solar Wind Density', 'Ap Index', '24hr Ap Average' ]
-    _var_units = [ 'sfu', None, 'sfu', None, 'GW', None, 'GW', None,
-                   'nT', 'degrees', 'km/s', 'nT', 'cm^-3', None, None ]
-
-    def __init__(self, start_date, mins, path, outfile, append, coupled, ewam, egeo, eaur):
+    def __init__(self, start_date, mins, path, outfile, append, coupled, ewam, egeo, eaur, cache=None, incremental=False, sync_every=1, workers=1, profiler=None, nc_format=NC_FORMAT):
         self.start_date = start_date
         self.date_list   = [start_date + timedelta(minutes=i-SW_DATE_BACKWARDS) for i in range(mins+SW_DATE_BACKWARDS+MAX_WAIT)]
         self.output_list = [start_date + timedelta(minutes=i) for i in range(mins)]
@@ -111,217 +108,337 @@ class InputParameters(object):
         self.fgeo_date = egeo
         self.faur_date = eaur
 
-        self.f107a = InputParameter(lambda x: F107A_MIN) # 'self_avg'
-        self.f107  = InputParameter(lambda x: F107_MIN) # np.nanmean(self.f107d.values())
-        self.apa   = InputParameter(lambda x: KP_RELAX)
-        self.ap    = InputParameter(lambda x: KP_RELAX)
-        self.kpa   = InputParameter(lambda x: KP_RELAX)
-        self.kp    = InputParameter(lambda x: KP_RELAX)
-        self.swbz  = InputParameter(lambda x: swbz_calc(swesw_calc(self.kp.dict[x]), self.swvel.dict[x]))
-        self.swbzo = InputParameter(lambda x: swbz_calc(swesw_calc(self.kp.dict[x]), self.swvel.dict[x]))
-        self.swbx  = InputParameter(lambda x: swby_calc())
-        self.swbxo = InputParameter(lambda x: swby_calc())
-        self.swby  = InputParameter(lambda x: swby_calc())
-        self.swbyo = InputParameter(lambda x: swby_calc())
-        self.swbt  = InputParameter(lambda x: swbt_calc(self.swbz.dict[x], self.swby.dict[x]))
-        self.swvel = InputParameter(lambda x: swvel_calc(self.kp.dict[x]))
-        self.swveo = InputParameter(lambda x: swvel_calc(self.kp.dict[x]))
-        self.swang = InputParameter(lambda x: swang_calc(swby_calc(), self.swbz.dict[x]))
-        self.swden = InputParameter(lambda x: swden_calc())
-        self.swdeo = InputParameter(lambda x: swden_calc())
-        self.hpn   = InputParameter(lambda x: hemi_pow_calc(self.kp.dict[x]))
-        self.hpin  = InputParameter(lambda x: hpi_from_gw(self.hpn.dict[x]))
-        self.hps   = InputParameter(lambda x: hemi_pow_calc(self.kp.dict[x]))
-        self.hpis  = InputParameter(lambda x: hpi_from_gw(self.hps.dict[x]))
+        self.f107a = InputParameter(lambda t, n: F107A_MIN) # 'self_avg'
+        self.f107  = InputParameter(lambda t, n: F107_MIN) # np.nanmean(self.f107d.values())
+        self.apa   = InputParameter(lambda t, n: KP_RELAX)
+        self.ap    = InputParameter(lambda t, n: KP_RELAX)
+        self.kpa   = InputParameter(lambda t, n: KP_RELAX)
+        self.kp    = InputParameter(lambda t, n: KP_RELAX)
+        self.swbz  = InputParameter(lambda t, n: swbz_calc(swesw_calc(self.kp.window(t, n)), self.swvel.window(t, n)))
+        self.swbzo = InputParameter(lambda t, n: swbz_calc(swesw_calc(self.kp.window(t, n)), self.swvel.window(t, n)))
+        self.swbx  = InputParameter(lambda t, n: swby_calc())
+        self.swbxo = InputParameter(lambda t, n: swby_calc())
+        self.swby  = InputParameter(lambda t, n: swby_calc())
+        self.swbyo = InputParameter(lambda t, n: swby_calc())
+        self.swbt  = InputParameter(lambda t, n: swbt_calc(self.swbz.window(t, n), self.swby.window(t, n)))
+        self.swvel = InputParameter(lambda t, n: swvel_calc(self.kp.window(t, n)))
+        self.swveo = InputParameter(lambda t, n: swvel_calc(self.kp.window(t, n)))
+        self.swang = InputParameter(lambda t, n: swang_calc(swby_calc(), self.swbz.window(t, n)))
+        self.swden = InputParameter(lambda t, n: swden_calc())
+        self.swdeo = InputParameter(lambda t, n: swden_calc())
+        self.hpn   = InputParameter(lambda t, n: hemi_pow_calc(self.kp.window(t, n)))
+        self.hpin  = InputParameter(lambda t, n: hpi_from_gw(self.hpn.window(t, n)))
+        self.hps   = InputParameter(lambda t, n: hemi_pow_calc(self.kp.window(t, n)))
+        self.hpis  = InputParameter(lambda t, n: hpi_from_gw(self.hps.window(t, n)))
 
         self.path    = path
         self.outfile = outfile
         self.append  = append
         self.coupled = coupled
 
-    def linear_int_missing_vals(self, mydict, relax_func, cutoff=False):
-        try:
-            sorted_keys = sorted(mydict.keys())
-            b = np.asarray([mydict[k] for k in sorted_keys],dtype='float64')
-            c = np.isnan(b)
-            ok = ~c
-            xp = ok.ravel().nonzero()[0]
-            fp = b[ok]
-            x = c.ravel().nonzero()[0]
-            b[c] = np.interp(x,xp,fp)
-            if cutoff:
-                b = b[:np.where(ok)[0][-1]+1]
-        except:
-            b = []
-        return key_dependent_dict(relax_func, zip(sorted_keys,b))
-
-    def ap_from_kp(self, v):
-        lookup = v*3
-        remainder = lookup - int(lookup)
-        return (1 - remainder) * self._lookup_table[int(lookup)] + \
-                    remainder  * self._lookup_table[int(lookup) + 1]
-
-    def kp_from_ap(self, v):
-        idx = list(x > v for x in self._lookup_table).index(True)
-        return ((v - self._lookup_table[idx-1])/(self._lookup_table[idx]-self._lookup_table[idx-1]) + idx - 1) / 3
+        # decoded geospace_input files, persisted under cache if given
+        self.geospace_records = RecordCache(read_geospace_input, cache, 'geospace_input.json')
+
+        # incremental mode only reads input it has not seen before: wam_input
+        # files are parsed once, aurora power files are read on from the bytes
+        # already consumed, and geospace_input is only looked up for minutes
+        # without an observation. what it merges, and how it fills, is the same
+        # as in full mode, so both give the same output
+        self.incremental  = incremental
+        self.wam_items    = {}   # (items, ok, size) of each complete wam_input file parsed
+        self.aurora_items = {}   # (items, last time) read so far from each aurora power file
+        self.aurora_read  = {}   # bytes of each aurora power file read so far
+
+        # threads reading input files in parse, 1 reads them in turn
+        self.workers = workers
+
+        # input_parameters.nc stays open between netcdf_output calls until close.
+        # a NETCDF4 file is chunked in whole segments of mins minutes
+        self.writer     = None
+        self.sync_every = sync_every
+        self.nc_format  = nc_format
+        self.nc_chunk   = chunk_records(mins)
+
+        # stage timings, see profiling.py. the default records nothing
+        self.profiler = profiler if profiler is not None else StageProfiler()
+
+    def segment(self, start, mins):
+        # point date_list and output_list at the mins minutes from start
+        self.date_list   = [ start + timedelta(minutes=x) for x in range(mins+MAX_WAIT) ]
+        self.output_list = [ start + timedelta(minutes=x) for x in range(mins) ]
+
+    def window(self):
+        # start and count of date_list
+        return self.date_list[0], len(self.date_list)
+
+    @profiled('relax')
+    def relax_missing_vals(self, param):
+        # fill whatever is still missing over date_list by relaxation
+        param.relax(*self.window(), param.relax_func, TIME_CONSTANT)
+
+    @profiled('interpolate')
+    def linear_int_missing_vals(self, param, cutoff=False):
+        # fill the gaps over date_list linearly between values, then relax
+        # past the last one
+        param.interpolate(*self.window(), cutoff)
+        self.relax_missing_vals(param)
 
     def all_kp_from_ap(self):
-        self.kp.dict = self.ap.dict.copy()
-        for k,v in self.kp.dict.items():
-            self.kp.dict[k] = self.kp_from_ap(v)
-
-        self.kpa.dict = self.apa.dict.copy()
-        for k,v in self.kpa.dict.items():
-            self.kpa.dict[k] = self.kp_from_ap(v)
-        
-
-    def parse_geospace_input(self):
-        swbz  = self.swbz.dict
-        swby  = self.swby.dict
-        swbx  = self.swbx.dict
-        swden = self.swden.dict
-        swvel = self.swvel.dict
-#        for k in self.date_list:
-#            swbz[k]  = None
-#            swby[k]  = None
-#            swbx[k]  = None
-#            swden[k] = None
-#            swvel[k] = None
+        self.kp  = self.ap.map(kp_from_ap)
+        self.kpa = self.apa.map(kp_from_ap)
 
-        for date in self.date_list:
-            if date - timedelta(minutes=DELAY_INTERVAL) > self.egeo_date:
-                break
+    def geospace_listing(self, day):
+        # names of the geospace_input files in day's swpc directory
+        try:
+            return set(name for name in os.listdir(day) if name.startswith('geospace_input-'))
+        except OSError:
+            return set()
+
+    def read_geospace_day(self, day, dates):
+        # dates and records of the geospace_input files in day's swpc
+        # directory for the minutes in dates, and the bytes of those files
+        names = self.geospace_listing(day)
+        found = []
+        obs   = []
+        size  = 0
+        for date in dates:
+            fd = date - timedelta(minutes=DELAY_INTERVAL)
+            name = 'geospace_input-{}.xml'.format(fd.strftime(FILE_FMT))
+            if name not in names:
+                continue
             try:
-                fd = date - timedelta(minutes=DELAY_INTERVAL)
-                file = '{}/{}/swpc/geospace_input-{}.xml'.format(self.path,\
-                           fd.strftime(PATH_FMT),fd.strftime(FILE_FMT))
-                item = ET.parse(file).getroot().find('data-item')
-                swbz[date]  = float(item.find('mag_bz_gsm').text)
-                swbx[date]  = float(item.find('mag_bx_gsm').text)
-                swby[date]  = float(item.find('mag_by_gsm').text)
-                swden[date] = float(item.find('proton_density').text)
-                swvel[date] = float(item.find('proton_speed').text)
-                self.fgeo_date = fd
-            except:
+                st = os.stat(os.path.join(day, name))
+                obs.append(self.geospace_records.get(day, name, st.st_mtime_ns))
+                found.append(date)
+                size += st.st_size
+            except Exception:
                 pass
+        return found, obs, size
 
-        swbz  = self.linear_int_missing_vals(swbz,  self.swbz.backwards_search, True)
-        swbx  = self.linear_int_missing_vals(swbx,  self.swbx.backwards_search, True)
-        swby  = self.linear_int_missing_vals(swby,  self.swby.backwards_search, True)
-        swvel = self.linear_int_missing_vals(swvel, self.swvel.backwards_search, True)
-        swden = self.linear_int_missing_vals(swden, self.swden.backwards_search, True)
-
-        # now backfill with all available data
-        for k in self.date_list:
-            self.swvel.dict[k] = swvel[k]
-            self.swbz.dict[k]  = swbz[k]
-            self.swby.dict[k]  = swby[k]
-            self.swbx.dict[k]  = swbx[k]
-            self.swden.dict[k] = swden[k]
-
-        # for solar wind, do averaging
-        self.swbzo.dict = self.swbz.running_average(AVERAGING_INTERVAL)
-        self.swbyo.dict = self.swby.running_average(AVERAGING_INTERVAL)
-        self.swbxo.dict = self.swbx.running_average(AVERAGING_INTERVAL)
-        self.swdeo.dict = self.swden.running_average(AVERAGING_INTERVAL)
-        self.swveo.dict = self.swvel.running_average(AVERAGING_INTERVAL)
+    def read_geospace_input(self, pool):
+        # one job per day directory, in time order
+        days = {}
+        for date in self.date_list:
+            if self.incremental and self.swbz.observed(date):
+                # read by an earlier parse, the file has not changed since
+                continue
+            fd = date - timedelta(minutes=DELAY_INTERVAL)
+            if fd > self.egeo_date:
+                break
+            days.setdefault('{}/{}/swpc'.format(self.path, fd.strftime(PATH_FMT)), []).append(date)
+        return [pool.submit(self.read_geospace_day, day, dates) for day, dates in days.items()]
+
+    @profiled('parse_geospace_input')
+    def parse_geospace_input(self, jobs=None):
+        if jobs is None:
+            jobs = self.read_geospace_input(SerialPool())
+        dates = []
+        obs   = []
+        size  = 0
+        for job in jobs:
+            found, records, nbytes = job.result()
+            dates += found
+            obs   += records
+            size  += nbytes
+        self.profiler.count('parse_geospace_input', len(dates), size, len(dates))
+        self.geospace_records.save()
+
+        # observations overwrite their own minutes only. minutes filled by an
+        # earlier parse keep their values, only those still missing are filled
+        obs = np.asarray(obs, dtype='float64').reshape(-1, 5)
+        for i, param in enumerate([self.swbz, self.swbx, self.swby, self.swden, self.swvel]):
+            param.assign(dates, obs[:,i])
+        if dates:
+            # the newest observation over date_list, which in incremental mode
+            # may have been read by an earlier parse
+            last = self.swbz.last_observed(self.date_list[-1] + timedelta(minutes=1))
+            self.fgeo_date = last - timedelta(minutes=DELAY_INTERVAL)
+
+        # gaps relax from the previous minute, swvel first as swbz relaxes toward it
+        for param in [self.swvel, self.swbz, self.swby, self.swbx, self.swden]:
+            self.relax_missing_vals(param)
+
+        # for solar wind, do averaging. only date_list changes, the averages
+        # before it are kept from earlier parses
+        with self.profiler.stage('running_average'):
+            first, count = self.window()
+            for avg, param in [(self.swbzo, self.swbz), (self.swbyo, self.swby), (self.swbxo, self.swbx),
+                               (self.swdeo, self.swden), (self.swveo, self.swvel)]:
+                avg.put(first, param.trailing_mean(first, count, AVERAGING_INTERVAL))
 
         # and get swbt and swang
-        for k in self.output_list:
-            self.swbt.dict[k]  = swbt_calc(self.swbzo.dict[k],self.swbyo.dict[k])
-            self.swang.dict[k] = swang_calc(self.swbyo.dict[k],self.swbzo.dict[k])
-
-    def parse_aurora_power(self):
-        hpn  = self.hpn.dict.copy()
-        hps  = self.hps.dict.copy()
-        for k in self.date_list:
-            hpn[k] = None
-            hps[k] = None
-
-        days = sorted(list(set([datetime(dt.year, dt.month, dt.day) for dt in [date - timedelta(minutes=L1_DELAY) for date in self.date_list]])))
-
-        for day in days:
-            try:
-                file = '{}/{}/swpc/wam/swpc_aurora_power_{}.txt'.format(self.path, \
-                           day.strftime(PATH_FMT), day.strftime(PATH_FMT))
-                with open(file) as f:
-                    lines = list(filter(lambda s: not s.startswith('#') ,f.readlines()))
-                for line in lines:
+        start, count = self.output_list[0], len(self.output_list)
+        swbzo = self.swbzo.window(start, count)
+        swbyo = self.swbyo.window(start, count)
+        self.swbt.put(start,  swbt_calc(swbzo, swbyo))
+        self.swang.put(start, swang_calc(swbyo, swbzo))
+
+    def read_aurora_file(self, file, offset):
+        # (time, north, south) lines of an aurora power file from byte offset,
+        # the last time read and the bytes consumed. lines before a bad one
+        # are kept. consumed bytes end with the last line taken, so a line
+        # past eaur_date or a bad one is read again by the next parse
+        items = []
+        faur  = None
+        size  = 0
+        try:
+            with open(file, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            if self.incremental:
+                # leave a line still being written for the next parse
+                data = data[:data.rfind(b'\n')+1]
+            for line in data.decode().splitlines(True):
+                if not line.startswith('#'):
                     split = line.split()
                     dt = datetime.strptime(split[0],'%Y-%m-%d_%H:%M')
                     if dt > self.eaur_date:
                         break
-                    self.faur_date = dt
-                    dt += timedelta(minutes=L1_DELAY)
-
-                    hpn[dt] = float(split[-2])
-                    hps[dt] = float(split[-1])
-            except Exception as e:
-                # print(str(e))
-                pass
-
-        hpn  = self.linear_int_missing_vals(hpn,  self.hpn.backwards_search, True)
-        hps  = self.linear_int_missing_vals(hps,  self.hps.backwards_search, True)
-        # now backfill with all available data
-        for k in self.date_list:
-            self.hpn.dict[k]  = hpn[k]
-            self.hps.dict[k]  = hps[k]
-            self.hpin.dict[k] = hpi_from_gw(self.hpn.dict[k])
-            self.hpis.dict[k] = hpi_from_gw(self.hps.dict[k])
-
-    def parse_wam_input(self):
-        f107  = self.f107.dict
-        f107a = self.f107a.dict
-        ap    = self.ap.dict
-        apa   = self.apa.dict
-
-        for k in self.date_list:
-            f107[k]  = None
-            f107a[k] = None
-            ap[k]    = None
-            apa[k]   = None
-
+                    faur = dt
+                    items.append((dt + timedelta(minutes=L1_DELAY), float(split[-2]), float(split[-1])))
+                size += len(line.encode())
+        except Exception as e:
+            # print(str(e))
+            pass
+        return items, faur, size
+
+    def read_aurora_power(self, pool):
+        # one job per daily file, in time order
+        days = sorted(list(set([datetime(dt.year, dt.month, dt.day) for dt in [date - timedelta(minutes=L1_DELAY) for date in self.date_list]])))
+        files = ['{}/{}/swpc/wam/swpc_aurora_power_{}.txt'.format(self.path, \
+                     day.strftime(PATH_FMT), day.strftime(PATH_FMT)) for day in days]
+        return [(file, pool.submit(self.read_aurora_file, file, self.aurora_read.get(file, 0) if self.incremental else 0))
+                for file in files]
+
+    @profiled('parse_aurora_power')
+    def parse_aurora_power(self, jobs=None):
+        if jobs is None:
+            jobs = self.read_aurora_power(SerialPool())
+        self.hpn.clear(*self.window())
+        self.hps.clear(*self.window())
+        hpn = {}
+        hps = {}
+
+        aurora_items = {}
+        aurora_read  = {}
+        for file, job in jobs:
+            items, faur, size = job.result()
+            self.profiler.count('parse_aurora_power', 1 if size else 0, size, len(items))
+            if self.incremental:
+                # the lines read by earlier parses come first
+                read, last = self.aurora_items.get(file, ([], None))
+                items = read + items
+                faur  = faur if faur is not None else last
+                aurora_items[file] = (items, faur)
+                aurora_read[file]  = self.aurora_read.get(file, 0) + size
+            for dt, north, south in items:
+                hpn[dt] = north
+                hps[dt] = south
+            if faur is not None:
+                self.faur_date = faur
+        # files that date_list has moved past are dropped
+        self.aurora_items = aurora_items
+        self.aurora_read  = aurora_read
+
+        start, count = self.window()
+        for hp, hpi, obs in [(self.hpn, self.hpin, hpn), (self.hps, self.hpis, hps)]:
+            hp.assign(list(obs.keys()), list(obs.values()))
+            self.linear_int_missing_vals(hp, True)
+            hpi.put(start, hpi_from_gw(hp.window(start, count)))
+
+    def read_wam_input(self, pool):
+        # one job per wam_input file, in time order
         days = set([dt.strftime('%Y%m%d') for dt in self.date_list])
         files = sorted([i for day in days for i in glob.glob('{}/{}/swpc/wam/wam_input*'.format(self.path, day))])
 
+        jobs = []
         for file in files:
             fn = basename(file)
             dt = datetime.strptime(fn, 'wam_input-%Y%m%dT%H%M.xml')
             if dt > self.ewam_date: continue
-
-            try:
-                root = ET.parse(file).getroot()
-                time = datetime.strptime(root.find('data-item').get('time-tag'), WAM_INPUT_FMT)
-                for child in root.findall('data-item'):
-                    time = datetime.strptime(child.get('time-tag'), WAM_INPUT_FMT)
-                    if time.hour == 12:
-                        f107[time]  = max(float(child.find('f10').text), F107_MIN)
-                        f107a[time] = max(float(child.find('f10-41-avg').text), F107A_MIN)
-                    ap[time]  = self.ap_from_kp(min(float(child.find('kp').text), KP_MAX))
-                    apa[time] = self.ap_from_kp(min(float(child.find('kp-24-hr-avg').text), KPA_MAX))
+            if file in self.wam_items:
+                job = Future()
+                job.set_result(self.wam_items[file])
+            else:
+                job = pool.submit(read_wam_input, file)
+            jobs.append((dt, file, job))
+        return jobs
+
+    @profiled('parse_wam_input')
+    def parse_wam_input(self, jobs=None):
+        if jobs is None:
+            jobs = self.read_wam_input(SerialPool())
+        for param in [self.f107, self.f107a, self.ap, self.apa]:
+            param.clear(*self.window())
+
+        obs = { 'f107' : {}, 'f107a' : {}, 'kp' : {}, 'kpa' : {} }
+        wam_items = {}
+        for dt, file, job in jobs:
+            items, ok, size = job.result()
+            for name, time, value in items:
+                obs[name][time] = value
+            if file not in self.wam_items:
+                self.profiler.count('parse_wam_input', 1, size, len(items))
+            if ok:
                 self.fwam_date = dt
-            except:
-                pass
+                if self.incremental:
+                    # complete files do not change, files still being written are read again
+                    wam_items[file] = (items, ok, size)
+        # files that date_list has moved past are dropped
+        self.wam_items = wam_items
+        f107, f107a, kp, kpa = obs['f107'], obs['f107a'], obs['kp'], obs['kpa']
+
+        self.f107.assign(list(f107.keys()),   list(f107.values()))
+        self.f107a.assign(list(f107a.keys()), list(f107a.values()))
+        # convert the Kp read above to Ap in one pass
+        self.ap.assign(list(kp.keys()),   ap_from_kp(list(kp.values())))
+        self.apa.assign(list(kpa.keys()), ap_from_kp(list(kpa.values())))
         # and interpolate them
-        f107  = self.linear_int_missing_vals(f107,  self.f107.backwards_search)
-        f107a = self.linear_int_missing_vals(f107a, self.f107a.backwards_search)
-        ap    = self.linear_int_missing_vals(ap,    self.ap.backwards_search)
-        apa   = self.linear_int_missing_vals(apa,   self.apa.backwards_search)
-        # now backfill with all available data
-        for k in self.date_list:
-            self.f107.dict[k]  = f107[k]
-            self.f107a.dict[k] = f107a[k]
-            self.ap.dict[k]    = ap[k]
-            self.apa.dict[k]   = apa[k]
+        for param in [self.f107, self.f107a, self.ap, self.apa]:
+            self.linear_int_missing_vals(param)
         # and get Kp
         self.all_kp_from_ap()
 
-    def parse(self):
-        self.parse_wam_input()
-        self.parse_geospace_input()
-        self.parse_aurora_power()
+    @profiled('read')
+    def read(self, pool):
+        # jobs reading all three sources, see parse, and the futures among
+        # them, so callers can wait on them without knowing each job's shape
+        wam, geo, aur = self.read_wam_input(pool), self.read_geospace_input(pool), self.read_aurora_power(pool)
+        futures = [job for _, _, job in wam] + geo + [job for _, job in aur]
+        return (wam, geo, aur), futures
 
-    def output(self):
+    def merge(self, jobs):
+        wam, geo, aur = jobs
+        self.parse_wam_input(wam)
+        self.parse_geospace_input(geo)
+        self.parse_aurora_power(aur)
+
+    def parse(self):
+        # all three sources are read before any is merged, on a thread pool
+        # when workers > 1. merging always runs in file order, so the result
+        # does not depend on the pool
+        pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else SerialPool()
+        try:
+            self.merge(self.read(pool)[0])
+        finally:
+            if self.workers > 1:
+                pool.shutdown()
+
+    def txt_columns(self):
+        # minutes since EPOCH and TXT_COLUMNS arrays of output_list
+        start, count = self.output_list[0], len(self.output_list)
+        columns = [self.f107.window(start, count),  self.kp.window(start, count),
+                   self.f107a.window(start, count), self.kpa.window(start, count),
+                   self.hpn.window(start, count),   self.hpin.window(start, count).astype(int),
+                   self.hps.window(start, count),   self.hpis.window(start, count).astype(int),
+                   self.swbt.window(start, count),  self.swang.window(start, count),
+                   self.swveo.window(start, count), self.swbzo.window(start, count),
+                   self.swdeo.window(start, count)]
+        minutes = epoch_minutes(self.output_list[0]) + np.arange(len(self.output_list))
+        return minutes, columns
+
+    @profiled('write_txt')
+    def write_txt(self, filename, minutes, columns):
         mode = 'w'
         if self.append:
             mode = 'a'
@@ -329,78 +446,53 @@ class InputParameters(object):
                           'NHemiPow','NHemiPowIdx','SHemiPow','SHemiPowIdx','SW_Bt','SW_Angle','SW_Velocity','SW_Bz','SW_Den']
         header_formats = ['{:<20}','{:>12}','{:>12}','{:>12}','{:>12}','{:>12}','{:>12}',\
                           '{:>12}','{:>12}','{:>12}','{:>12}','{:>12}','{:>12}','{:>12}','{:>12}','{:>12}\n']
-        output_formats = ['{:<20}','{:>12.7f}','{:>12.7f}','{:>12}','{:>12}','{:>12.7f}','{:>12.7f}',\
-                          '{:>12.7f}','{:>12}','{:>12.7f}','{:>12}','{:>12.7f}','{:>12.7f}','{:>12.7f}','{:>12.7f}','{:>12.7f}\n']
-        fields = lambda k: [k.strftime(WAM_INPUT_FMT),self.f107.dict[k],self.kp.dict[k],'2','1',self.f107a.dict[k],\
-                            self.kpa.dict[k],self.hpn.dict[k],self.hpin.dict[k],self.hps.dict[k],self.hpis.dict[k],\
-                            self.swbt.dict[k],self.swang.dict[k],self.swveo.dict[k],self.swbzo.dict[k],self.swdeo.dict[k]]
-        with open(self.outfile, mode) as f:
+        with open(filename, mode) as f:
             if not self.append:
                 f.write('Issue Date          {}\n'.format(datetime.now().strftime(WAM_INPUT_FMT)))
                 f.write('Flags:  0=Forecast, 1=Estimated, 2=Observed \n\n')
                 for fmt, name in zip(header_formats,output_fields):
                     f.write(fmt.format(name))
                 f.write('{}\n'.format('-'*(12*len(output_fields)+8)))
-            for date in self.output_list:
-                for fmt, field in zip(output_formats, fields(date)):
-                    f.write(fmt.format(field))
+            write_txt_rows(f, minutes, columns)
+        self.profiler.count('write_txt', records=len(minutes))
 
+    @profiled('output')
+    def output(self):
+        self.write_txt(self.outfile, *self.txt_columns())
+
+    def netcdf_fields(self):
+        # fields and global attributes of output_list for input_parameters.nc
+        params = [self.f107, self.kp, self.f107a, self.kpa, self.hpn, self.hpin, self.hps, self.hpis,
+                  self.swbt, self.swang, self.swveo, self.swbzo, self.swdeo, self.ap, self.apa]
+        start, count = self.output_list[0], len(self.output_list)
+        fields = dict((name, p.window(start, count)) for name, p in zip(VAR_NAMES, params))
+        fields['time'] = (epoch_minutes(self.output_list[0]) + np.arange(len(self.output_list))) / (24*60.)
+
+        attrs = { 'skip'                    : 36*60 if self.coupled else 0,
+                  'ifp_interval'            : 60,
+                  'final_swfo_f10_kp_date'  : self.fwam_date.strftime('%Y%m%d_%H%M%S'),
+                  'final_imf_date'          : self.fgeo_date.strftime('%Y%m%d_%H%M%S'),
+                  'final_aurora_power_date' : self.faur_date.strftime('%Y%m%d_%H%M%S') }
+        return fields, attrs
+
+    @profiled('write_netcdf')
+    def write_netcdf(self, filename, fields, attrs):
+        if self.writer is not None and self.writer.filename != filename:
+            self.close()
+        if self.writer is None:
+            self.writer = NetcdfWriter(filename, 'f8', 'days since 1970-01-01', self.append, self.sync_every,
+                                       self.nc_format, self.nc_chunk)
+        self.writer.write(fields, attrs)
+        self.profiler.count('write_netcdf', records=len(fields['time']))
+
+    @profiled('netcdf_output')
     def netcdf_output(self):
-        _mode = 'w'
-        if self.append:
-            _mode = 'a'
-
-        _fields = lambda k: [date2num(k, 'days since 1970-01-01'),
-                             self.f107.dict[k], self.kp.dict[k], self.f107a.dict[k], self.kpa.dict[k],
-                             self.hpn.dict[k], self.hpin.dict[k], self.hps.dict[k], self.hpis.dict[k],
-                             self.swbt.dict[k], self.swang.dict[k], self.swveo.dict[k], self.swbzo.dict[k],
-                             self.swdeo.dict[k], self.ap.dict[k], self.apa.dict[k]]
-        # Open
-        _o = Dataset(self.outfile, _mode, format='NETCDF3_64BIT_OFFSET')
-        _vars = []
-
-        if self.coupled:
-            _o.skip = 36*60
-        else:
-            _o.skip = 0
-        _o.ifp_interval = 60
-
-        _o.final_swfo_f10_kp_date  = self.fwam_date.strftime('%Y%m%d_%H%M%S')
-        _o.final_imf_date          = self.fgeo_date.strftime('%Y%m%d_%H%M%S')
-        _o.final_aurora_power_date = self.faur_date.strftime('%Y%m%d_%H%M%S')
-
-        if not self.append:
-            # Dimensions
-            t_dim = _o.createDimension('time',  None)
-
-            t_var = _o.createVariable('time', 'f8', ('time',))
-            t_var.units     = 'days since 1970-01-01'
-
-            _vars.append(t_var)
-
-            # Variables
-            for i in range(len(self._var_names)):
-                _vars.append(_o.createVariable(self._var_names[i], self._var_types[i], ('time',)))
-                _vars[-1].long_name = self._var_long_names[i]
-                if self._var_units[i] is not None:
-                    _vars[-1].units = self._var_units[i]
-
-        else:
-            t_var = _o.variables['time']
-            _vars.append(t_var)
-            for i in range(len(self._var_names)):
-                _vars.append(_o.variables[self._var_names[i]])
-
-        # Output
-        _start = len(t_var[:])
-        _len = len(self.output_list)
-        _output_fields = []
-        for date in self.output_list:
-            _output_fields.append(_fields(date))
-        _output_arr = np.asarray(_output_fields)
-        for i, var in enumerate(_vars):
-            var[_start:_start+_len] = _output_arr[:,i]
-        _o.close()
+        self.write_netcdf(self.outfile, *self.netcdf_fields())
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
 def main():
     parser = ArgumentParser( \
@@ -416,6 +508,11 @@ def main():
     parser.add_argument('-e', '--ewam_date',  help='end date of wam-input (YYYYmmddHHMM)',      type=str, default=EDATE)
     parser.add_argument('-f', '--egeo_date',  help='end date of geospace-input (YYYYmmddHHMM)', type=str, default=EDATE)
     parser.add_argument('-g', '--eaur_date',  help='end date of aurora_power (YYYYmmddHHMM)',   type=str, default=EDATE)
+    parser.add_argument('-k', '--cache',      help='directory for decoded geospace_input records', type=str, default=None)
+    parser.add_argument('-j', '--workers',    help='threads reading input files', type=int, default=1)
+    parser.add_argument('-l', '--profile_log', help='append per-stage timings to this JSON-lines file', type=str, default=None)
+    parser.add_argument('-P', '--cprofile',   help='dump cProfile stats of the run to this file', type=str, default=None)
+    parser.add_argument('-F', '--nc_format',  help='format of input_parameters.nc', type=str, default=NC_FORMAT, choices=NC_FORMATS)
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start_date,'%Y%m%d%H%M')
@@ -423,15 +520,19 @@ def main():
     egeo_date  = datetime.strptime(args.egeo_date, '%Y%m%d%H%M')
     eaur_date  = datetime.strptime(args.eaur_date, '%Y%m%d%H%M')
 
-    ip = InputParameters(start_date, args.duration, args.path, args.output, args.append, args.coupled, ewam_date, egeo_date, eaur_date)
+    profiler = StageProfiler(args.profile_log, args.cprofile)
+    ip = InputParameters(start_date, args.duration, args.path, args.output, args.append, args.coupled, ewam_date, egeo_date, eaur_date, args.cache, workers=args.workers, profiler=profiler, nc_format=args.nc_format)
     try:
         ip.parse()
         ip.netcdf_output()
+        ip.close()
         ip.outfile = 'wam_input_f107_kp.txt'
         ip.output()
+        profiler.flush(start_date)
     except Exception as e:
         traceback.print_exc()
         pass
+    profiler.close()
 
 
 if __name__ == '__main__':
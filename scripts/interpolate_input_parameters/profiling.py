@@ -0,0 +1,96 @@
+import cProfile
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# opt-in stage timings for the input parameter scripts. a stage is a named
+# block of work, timed on every call and credited with the files and bytes
+# it read and the records it produced. stages of the same name accumulate
+# until flush, which appends them as one JSON line per segment to log:
+#
+#   {"segment": ..., "written": ..., "stages": {name: {"calls", "seconds",
+#    "files", "bytes", "records"}, ...}}
+#
+# stages nest, so a stage's time includes that of the stages inside it.
+# with profile set, cProfile also runs from creation until close and its
+# stats are dumped there, for pstats or snakeviz. cProfile only sees the
+# thread that created the profiler, not the reader threads of -j.
+# a profiler without log or profile does nothing.
+
+FIELDS = ('calls', 'seconds', 'files', 'bytes', 'records')
+
+class StageProfiler(object):
+    def __init__(self, log=None, profile=None):
+        self.log     = log
+        self.profile = profile
+        self.enabled = log is not None
+        self.stages  = {}
+        self.lock    = threading.Lock()
+        self.cprofile = None
+        if profile is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def entry(self, name):
+        if name not in self.stages:
+            self.stages[name] = dict.fromkeys(FIELDS, 0)
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            with self.lock:
+                s = self.entry(name)
+                s['calls']   += 1
+                s['seconds'] += dt
+
+    def count(self, name, files=0, bytes=0, records=0):
+        # credit stage name with files and bytes read and records produced
+        if not self.enabled:
+            return
+        with self.lock:
+            s = self.entry(name)
+            s['files']   += files
+            s['bytes']   += bytes
+            s['records'] += records
+
+    def flush(self, segment=None):
+        # append the stages since the last flush as one line, segment being
+        # the datetime or label of what they worked on
+        if not self.enabled:
+            return
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        if isinstance(segment, datetime):
+            segment = segment.strftime('%Y-%m-%dT%H:%M:%S')
+        line = { 'segment' : segment,
+                 'written' : datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+                 'stages'  : stages }
+        with open(self.log, 'a') as f:
+            f.write(json.dumps(line) + '\n')
+
+    def close(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.profile)
+            self.cprofile = None
+
+def profiled(name):
+    # method decorator timing each call as stage name of self.profiler
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.stage(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,56 @@
+import json
+import os
+from netCDF4 import Dataset
+
+# reads the realtime wrapper makes on every check, kept independent of how
+# long the run has been going: the last line of a growing text file, the
+# record count of a growing NetCDF file, and the newest input file per source.
+
+def last_line(filename, block=4096):
+    # last non-blank line of a text file, read backwards from its end
+    with open(filename, 'rb') as f:
+        pos  = f.seek(0, os.SEEK_END)
+        data = b''
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data  = f.read(step) + data
+            lines = data.rstrip().rsplit(b'\n', 1)
+            if len(lines) == 2:
+                return lines[1].decode()
+        return data.strip().decode()
+
+def record_count(filename, dim='time'):
+    # length of the unlimited dimension, no variable is read
+    with Dataset(filename) as nc:
+        return len(nc.dimensions[dim])
+
+class LatestIndex(object):
+    # newest file seen per source, saved to filename as JSON on every change
+    # so a restarted wrapper picks up where the last one was
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.latest   = {}
+        if filename is not None:
+            try:
+                with open(filename) as f:
+                    self.latest = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def get(self, source, default=None):
+        return self.latest.get(source, default)
+
+    def update(self, source, name):
+        if self.latest.get(source) == name:
+            return
+        self.latest[source] = name
+        if self.filename is not None:
+            tmp = '{}.{}.tmp'.format(self.filename, os.getpid())
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(self.latest, f)
+                os.replace(tmp, self.filename)
+            except OSError:
+                pass
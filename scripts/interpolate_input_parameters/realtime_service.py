@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from realtime_wrapper import SLEEP_TIME, touch, proceed
+
+# realtime_wrapper's segment loop as an asyncio pipeline of four stages:
+#   watch:   wait until the input for a segment is in (or MAX_WAIT has passed)
+#   ingest:  read the segment's input files on InputParameters' workers
+#   compute: merge them into the series and snapshot the segment's output
+#   write:   append the snapshot to input_parameters.nc and the text file
+# stages hand segments on through queues, so segment N+1 is read and
+# computed while segment N is still being written. compute and write each
+# run on their own single thread: the series are only touched by compute,
+# and the files only by write. per-stage latency and queue backlog are
+# rewritten to status_file after every stage as JSON. with a profile log,
+# each written segment flushes the profiler stages recorded since the last,
+# which can include reads and merges of the segments computed ahead of it.
+
+NC_NAME  = 'input_parameters.nc'
+TXT_NAME = 'wam_input_f107_kp.txt'
+STAGES   = ('watch', 'ingest', 'compute', 'write')
+MAX_PENDING_WRITES = 2 # snapshots computed ahead of the writer
+
+class DriverService(object):
+    def __init__(self, ip, watcher, start, end, duration, status_file, sleep_time=SLEEP_TIME, outfile=NC_NAME):
+        self.ip          = ip
+        self.watcher     = watcher
+        self.start       = start
+        self.end         = end
+        self.duration    = duration
+        self.status_file = status_file
+        self.sleep_time  = sleep_time
+        self.outfile     = outfile
+
+        self.stats    = dict((stage, {'count': 0, 'last_s': 0., 'total_s': 0., 'max_s': 0.}) for stage in STAGES)
+        self.errors   = 0
+        self.last_error = None
+        self.latest   = None  # newest input date seen by the watcher
+        self.written  = start # end of the last segment written
+        self.ready    = None
+        self.pending  = None
+
+    def timed(self, stage, t0):
+        dt = time.monotonic() - t0
+        s  = self.stats[stage]
+        s['count']   += 1
+        s['last_s']   = dt
+        s['total_s'] += dt
+        s['max_s']    = max(s['max_s'], dt)
+        self.save_status()
+
+    def save_status(self):
+        stages = {}
+        for stage, s in self.stats.items():
+            stages[stage] = dict(s, mean_s=s['total_s'] / s['count'] if s['count'] else 0.)
+        status = { 'updated'      : datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+                   'written_until': self.written.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'end_date'     : self.end.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'latest_input' : self.latest.strftime('%Y-%m-%dT%H:%M:%S') if self.latest else None,
+                   'backlog'      : { 'ready'   : self.ready.qsize()   if self.ready   else 0,
+                                      'to_write': self.pending.qsize() if self.pending else 0 },
+                   'stages'       : stages,
+                   'errors'       : self.errors,
+                   'last_error'   : self.last_error }
+        tmp = '{}.{}.tmp'.format(self.status_file, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(status, f, indent=1)
+            os.replace(tmp, self.status_file)
+        except OSError:
+            pass
+
+    def error(self, e):
+        self.errors    += 1
+        self.last_error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        print(self.last_error)
+        self.save_status()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.io      = ThreadPoolExecutor(max(1, self.ip.workers))
+        self.cpu     = ThreadPoolExecutor(1)
+        self.out     = ThreadPoolExecutor(1)
+        self.ready   = asyncio.Queue()
+        self.pending = asyncio.Queue(MAX_PENDING_WRITES)
+        try:
+            await asyncio.gather(self.watch(loop), self.process(loop), self.write(loop))
+        finally:
+            for pool in [self.io, self.cpu, self.out]:
+                pool.shutdown()
+            self.save_status()
+
+    async def watch(self, loop):
+        current = self.start
+        t0 = time.monotonic()
+        while current < self.end:
+            target = current + timedelta(minutes=self.duration)
+            try:
+                self.latest = await loop.run_in_executor(None, self.watcher.latest_date)
+            except Exception as e:
+                self.error(e)
+                self.latest = datetime.min
+            if self.latest >= target or proceed(target):
+                self.timed('watch', t0)
+                await self.ready.put(current)
+                current = target
+                t0 = time.monotonic()
+            else:
+                await loop.run_in_executor(None, self.watcher.wait, self.sleep_time)
+        await self.ready.put(None)
+
+    def compute(self, jobs):
+        self.ip.merge(jobs)
+        return self.ip.netcdf_fields(), self.ip.txt_columns()
+
+    async def process(self, loop):
+        while True:
+            current = await self.ready.get()
+            if current is None:
+                await self.pending.put(None)
+                return
+            while True:
+                try:
+                    t0 = time.monotonic()
+                    self.ip.segment(current, self.duration)
+                    jobs, futures = await loop.run_in_executor(self.cpu, self.ip.read, self.io)
+                    await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+                    self.timed('ingest', t0)
+
+                    t0 = time.monotonic()
+                    snapshot = await loop.run_in_executor(self.cpu, self.compute, jobs)
+                    self.timed('compute', t0)
+                    break
+                except Exception as e:
+                    self.error(e)
+                    await asyncio.sleep(self.sleep_time)
+            await self.pending.put((current, snapshot))
+
+    def write_segment(self, current, snapshot):
+        (fields, attrs), (minutes, columns) = snapshot
+        self.ip.write_netcdf(self.outfile, fields, attrs)
+        self.ip.write_txt(TXT_NAME, minutes, columns)
+        touch(current)
+        self.ip.profiler.flush(current)
+
+    async def write(self, loop):
+        while True:
+            item = await self.pending.get()
+            if item is None:
+                return
+            current, snapshot = item
+            while True:
+                try:
+                    t0 = time.monotonic()
+                    await loop.run_in_executor(self.out, self.write_segment, current, snapshot)
+                    self.written = current + timedelta(minutes=self.duration)
+                    self.timed('write', t0)
+                    break
+                except Exception as e:
+                    self.error(e)
+                    await asyncio.sleep(self.sleep_time)
@@ -1,13 +1,15 @@
 #!/usr/bin/env python
+import os
 import parse_realtime as prt
 from datetime import datetime, timedelta
-from time import sleep
-from glob import glob
+from watcher import DriverWatcher
+from profiling import StageProfiler
+import asyncio
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-from netCDF4 import Dataset
+from realtime_io import last_line, record_count
+from driver_output import NC4_FORMAT, chunk_records, netcdf_layout, convert_netcdf
 
 SLEEP_TIME = 60
-DEFAULT_VAR = 'f107'
 
 def touch(dt):
     with open(dt.strftime("%Y%m%d_%H%M%S.lock"), "w") as f:
@@ -17,40 +19,20 @@ def proceed(dt):
     tdelta = datetime.now() - dt
     return (tdelta.days * (24*60*60) + tdelta.seconds) // 60 >= prt.MAX_WAIT
 
-def latest_date(path):
-    sw_search = '{}/*/swpc/geospace_input*.xml'.format(path)
-    hp_search = '{}/*/swpc/wam/swpc_aurora_power*.txt'.format(path)
-
-    sw_files = glob(sw_search)
-    hp_files = glob(hp_search)
-
-    sw_files.sort(reverse=True)
-    hp_files.sort(reverse=True)
-
-    sw_date = get_sw_date(sw_files[0].split('/')[-1])
-    try:
-        hp_date = get_hp_date(open(hp_files[0], 'r'))
-    except:
-        hp_date = sw_date - timedelta(days=1)
-
-    return min(sw_date, hp_date)
-
-def get_sw_date(filename):
-    return datetime.strptime(filename,'geospace_input-%Y%m%dT%H%M.xml') + \
-           timedelta(minutes = prt.DELAY_INTERVAL)
-
-def get_hp_date(fp):
-    last_line = fp.readlines()[-1].split()
-    try:
-        return datetime.strptime("{}{}".format(last_line[0],last_line[1]),'%Y-%m-%d%H:%M') + \
-               timedelta(minutes = prt.L1_DELAY)
-    except:
-        return datetime.strptime("{}".format(last_line[0]),'%Y-%m-%d_%H:%M') + \
-               timedelta(minutes = prt.L1_DELAY)
-
 def get_last_date(outfile):
-    with open(outfile, 'r') as f:
-        return datetime.strptime(f.readlines()[-1].split()[0],prt.WAM_INPUT_FMT)
+    return datetime.strptime(last_line(outfile).split()[0],prt.WAM_INPUT_FMT)
+
+def prepare_output(filename, nc_format, segment):
+    # segments are appended to an existing input_parameters.nc, which keeps
+    # the layout it was created with. rewrite it once in nc_format, NETCDF4
+    # chunked in whole segments, so -F applies to the file being extended.
+    # a symlinked filename is resolved, so the file linked to is rewritten
+    # and the link kept
+    chunk = chunk_records(segment) if nc_format == NC4_FORMAT else None
+    if netcdf_layout(filename) != (nc_format, chunk):
+        target = os.path.realpath(filename)
+        convert_netcdf(target, target + '.tmp', nc_format, chunk_records(segment))
+        os.replace(target + '.tmp', target)
 
 def main():
     parser = ArgumentParser( \
@@ -62,43 +44,65 @@ def main():
     parser.add_argument('-d', '--duration',    help='duration (mins) of each segment',   type=int, default=15)
     parser.add_argument('-p', '--path',        help='path to input parameters', type=str, default=prt.DEFAULT_PATH)
     parser.add_argument('-o', '--output',      help='full path to output file', type=str, default=prt.DEFAULT_NAME)
+    parser.add_argument('-k', '--cache',       help='directory for decoded geospace_input records', type=str, default=None)
+    parser.add_argument('-x', '--index',       help='file keeping the newest input files across restarts', type=str, default=None)
+    parser.add_argument('-w', '--poll',        help='poll for new input instead of using inotify', default=False, action='store_true')
+    parser.add_argument('-y', '--sync',        help='sync input_parameters.nc every this many segments, 0 only at the end', type=int, default=1)
+    parser.add_argument('-j', '--workers',     help='threads reading input files', type=int, default=1)
+    parser.add_argument('-i', '--incremental', help='only read and refill input newer than the last segment', default=False, action='store_true')
+    parser.add_argument('-S', '--status',      help='run as an asyncio service writing its status to this JSON file', type=str, default=None)
+    parser.add_argument('-l', '--profile_log', help='append per-stage timings of each segment to this JSON-lines file', type=str, default=None)
+    parser.add_argument('-P', '--cprofile',    help='dump cProfile stats of the run to this file', type=str, default=None)
+    parser.add_argument('-F', '--nc_format',   help='format of input_parameters.nc, an existing file is converted on start, NETCDF4 is chunked in whole segments', type=str, default=prt.NC_FORMAT, choices=prt.NC_FORMATS)
 
     args = parser.parse_args()
 
     end_date = datetime.strptime(args.end_date,'%Y%m%d%H%M')
 
+    prepare_output(args.output, args.nc_format, args.duration)
+
     current_date = datetime.strptime(args.current_date,'%Y%m%d%H%M')
-    current_date += timedelta(minutes=len(Dataset(args.output).variables[DEFAULT_VAR][:]))
+    current_date += timedelta(minutes=record_count(args.output))
 
     target_date = current_date + timedelta(minutes=args.duration)
 
     driver_end_date = datetime.strptime(prt.EDATE, '%Y%m%d%H%M')
 
-    ip = prt.InputParameters(current_date, args.duration, args.path, args.output, True, True, *[driver_end_date]*3)
+    profiler = StageProfiler(args.profile_log, args.cprofile)
+    ip = prt.InputParameters(current_date, args.duration, args.path, args.output, True, True, *[driver_end_date]*3, cache=args.cache, incremental=args.incremental, sync_every=args.sync, workers=args.workers, profiler=profiler, nc_format=args.nc_format)
     ip.parse()
-
-    while current_date < end_date:
-        if latest_date(args.path) >= target_date or proceed(target_date):
-            try:
-                ip.date_list   = [ current_date + timedelta(minutes=x) for x in range(args.duration+prt.MAX_WAIT)  ]
-                ip.output_list = [ current_date + timedelta(minutes=x) for x in range(args.duration) ]
-                # parse
-                ip.parse()
-                # write
-                ip.outfile = 'input_parameters.nc'
-                ip.netcdf_output()
-                ip.outfile = 'wam_input_f107_kp.txt'
-                ip.output()
-                # touch and advance
-                touch(current_date)
-                current_date += timedelta(minutes=args.duration)
-                target_date  += timedelta(minutes=args.duration)
-            except Exception as e:
-                print(e)
-                pass
-        else:
-            sleep(SLEEP_TIME)
-
+    profiler.flush('initial')
+
+    watcher = DriverWatcher(args.path, not args.poll, args.index)
+    if args.status is not None:
+        from realtime_service import DriverService
+        asyncio.run(DriverService(ip, watcher, current_date, end_date, args.duration, args.status, outfile=args.output).run())
+    else:
+        while current_date < end_date:
+            if watcher.latest_date() >= target_date or proceed(target_date):
+                try:
+                    ip.segment(current_date, args.duration)
+                    # parse
+                    ip.parse()
+                    # write
+                    ip.outfile = args.output
+                    ip.netcdf_output()
+                    ip.outfile = 'wam_input_f107_kp.txt'
+                    ip.output()
+                    # touch and advance
+                    touch(current_date)
+                    profiler.flush(current_date)
+                    current_date += timedelta(minutes=args.duration)
+                    target_date  += timedelta(minutes=args.duration)
+                except Exception as e:
+                    print(e)
+                    pass
+            else:
+                watcher.wait(SLEEP_TIME)
+
+    watcher.close()
+    ip.close()
+    profiler.close()
     touch(end_date)
 
 if __name__ == '__main__':
@@ -1,27 +1,11 @@
 import math
 import numpy
 
+HPI_BINS = [2.5, 3.94, 6.22, 9.82, 15.49, 24.44, 38.56, 60.85, 96.0]
+
 def hpi_from_gw(gw):
-  if gw <= 2.5:
-    return '1'
-  elif gw <= 3.94:
-    return '2'
-  elif gw <= 6.22:
-    return '3'
-  elif gw <= 9.82:
-    return '4'
-  elif gw <= 15.49:
-    return '5'
-  elif gw <= 24.44:
-    return '6'
-  elif gw <= 38.56:
-    return '7'
-  elif gw <= 60.85:
-    return '8'
-  elif gw <= 96.0:
-    return '9'
-  else:
-    return '10'
+  # hemispheric power index 1-10 for power in GW, bins are closed on the right
+  return numpy.digitize(gw, HPI_BINS, right=True) + 1
 
 def swbt_calc(swbz,swby):
   return numpy.sqrt(swbz**2+swby**2)
@@ -51,33 +35,25 @@ def hemi_pow_calc(kp):
   return 1.29 + 15.60*kp - 4.93*kp**2 + 0.64*kp**3
 
 def calc_solar_data(kp,f107):
-  mylen = len(f107)
-  swesw    = numpy.ones(mylen)
-  swbt     = numpy.ones(mylen)
-  swangle  = numpy.ones(mylen)
-  swvel    = numpy.ones(mylen)
-  swden    = numpy.ones(mylen)
-  swbz     = numpy.ones(mylen)
-  hemi_pow = numpy.ones(mylen)
-  hemi_pow_idx = numpy.ones(mylen)
-  for i in range(len(f107)):
-    swesw[i]        = swesw_calc(kp[i])
-    swbt[i]         = swbt_calc(swbz[i],swby_calc())
-    hemi_pow[i]     = hemi_pow_calc(kp[i])
-    swangle[i]      = swang_calc(swby_calc(),swbz[i])
-    swvel[i]        = swvel_calc(kp[i])
-    swbz[i]         = swbz_calc(swesw[i],swvel[i])
-    swden[i]        = swden_calc()
-    hemi_pow_idx[i] = hpi_from_gw(hemi_pow[i])
+  kp = numpy.asarray(kp, dtype='float64')
+  swby         = numpy.full(len(kp), swby_calc())
+  swvel        = swvel_calc(kp)
+  swbz         = swbz_calc(swesw_calc(kp),swvel)
+  swbt         = swbt_calc(swbz,swby)
+  swangle      = swang_calc(swby,swbz)
+  swden        = numpy.full(len(kp), swden_calc())
+  hemi_pow     = hemi_pow_calc(kp)
+  hemi_pow_idx = hpi_from_gw(hemi_pow)
   return swbt,swangle,swvel,swden,swbz,hemi_pow,hemi_pow_idx
 
 
 def cap_min_max(mylist,value,lt_flag=True,f107d=66.0):
-  for i,x in enumerate(mylist):
-    if lt_flag:
-      if x < value:
-        if i == 0: mylist[i] = f107d
-        else:      mylist[i] = mylist[i-1]
-    else:
-      if x > value: mylist[i] = value
-  return mylist
+  arr = numpy.array(mylist, dtype='float64')
+  if lt_flag:
+    # values below the cap take the last good value, or f107d at the start
+    bad = arr < value
+    if len(arr) and bad[0]: arr[0] = f107d
+    idx = numpy.where(bad, 0, numpy.arange(len(arr)))
+    return arr[numpy.maximum.accumulate(idx)]
+  else:
+    return numpy.minimum(arr, value)
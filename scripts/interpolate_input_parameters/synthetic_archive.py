@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+from datetime import datetime, timedelta
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from kp_ap import ap_from_kp
+from sw_from_f107_kp import hpi_from_gw
+
+# synthetic input trees for interpolate_input_parameters.py (-p) and for
+# parse_realtime.py / realtime_wrapper.py (-p), laid out and formatted like
+# the SWPC files, so the original readers parse them as well as the current
+# ones. values are random walks in plausible ranges, they only need to look
+# like data to the parsers, not to a physicist.
+#
+#   archive:  KP_AP_F107/<year>, 24HR_KP_AVG/<year>/<year>_doy<ddd>_avgkp.dat,
+#             AURORA_POWER/<year>/<yyyy-mm-dd>-input.txt
+#   realtime: <yyyymmdd>/swpc/geospace_input-<yyyymmddTHHMM>.xml,
+#             <yyyymmdd>/swpc/wam/wam_input-<yyyymmddTHHMM>.xml,
+#             <yyyymmdd>/swpc/wam/swpc_aurora_power_<yyyymmdd>.txt
+#
+# gap is the fraction of geospace minutes, aurora power lines and wam_input
+# files left out of a realtime tree. the archive readers expect complete
+# days, so archive trees have no gaps.
+
+HEMI_HEADER_LINES = 95
+F107_WINDOW       = 41 # days either side of a run read for the F10.7 average
+WAM_CADENCE       = 3  # hours between wam_input files
+AURORA_CADENCE    = 5  # minutes between aurora power lines
+
+def walk(rng, n, lo, hi, step):
+    # bounded random walk of n samples in [lo, hi]
+    x = np.empty(n)
+    x[0] = rng.uniform(lo, hi)
+    steps = rng.normal(0, step, n)
+    for i in range(1, n):
+        x[i] = min(max(x[i-1] + steps[i], lo), hi)
+    return x
+
+def kp_thirds(x):
+    # Kp rounded to the thirds it is published in
+    return np.round(np.asarray(x)*3)/3
+
+def write_kp_ap_f107(root, year, rng):
+    # one fixed-column line per day: YYMMDD, Bartels rotation and day, eight
+    # 3-hourly Kp*10, their sum, eight ap, Ap, Cp, C9 and sunspot number, then
+    # F10.7 in columns 66-71
+    days = (datetime(year+1, 1, 1) - datetime(year, 1, 1)).days
+    kp   = kp_thirds(walk(rng, days*8, 0, 9, 0.6)).reshape(days, 8)
+    ap   = np.round(ap_from_kp(kp)).astype(int)
+    f107 = walk(rng, days, 65, 250, 6)
+    os.makedirs(os.path.join(root, 'KP_AP_F107'), exist_ok=True)
+    with open(os.path.join(root, 'KP_AP_F107', str(year)), 'w') as f:
+        for d in range(days):
+            date = datetime(year, 1, 1) + timedelta(days=d)
+            kp10 = np.round(kp[d]*10).astype(int)
+            line = '{:%y%m%d}{:4d}{:2d}{}{:3d}{}{:3d}{:3.1f}{:1d}{:3d}'.format(
+                       date, 2400 + (date - datetime(1832, 2, 8)).days // 27 % 1000, d % 27 + 1,
+                       ''.join('{:2d}'.format(k) for k in kp10), int(kp10.sum()) % 1000,
+                       ''.join('{:3d}'.format(a) for a in ap[d]), int(ap[d].mean()),
+                       min(kp[d].mean() / 3, 2.5), int(min(kp[d].mean(), 9)), int(rng.integers(0, 200)))
+            f.write('{:<65}{:6.1f}{:1d}\n'.format(line, f107[d], 0))
+
+def write_archive(root, start, days, seed=0):
+    # root:  output directory
+    # start: datetime of the first day of the run
+    # days:  number of days the run covers
+    rng   = np.random.default_rng(seed)
+    first = start - timedelta(days=F107_WINDOW)
+    last  = start + timedelta(days=days + F107_WINDOW)
+    for year in range(first.year, last.year + 1):
+        write_kp_ap_f107(root, year, rng)
+
+    for d in range(days + 1):
+        date = start + timedelta(days=d)
+        year = str(date.year)
+        doy  = date.timetuple().tm_yday
+
+        os.makedirs(os.path.join(root, '24HR_KP_AVG', year), exist_ok=True)
+        stamps = [date + timedelta(minutes=m) for m in range(1440)]
+        kpa = walk(rng, 1440, 0, 9, 0.02)
+        with open(os.path.join(root, '24HR_KP_AVG', year, '{}_doy{:03d}_avgkp.dat'.format(year, doy)), 'w') as f:
+            # the reader takes the value from the last 10 columns
+            f.writelines('{:%Y-%m-%d %H:%M}{:10.4f}\n'.format(t, k) for t, k in zip(stamps, kpa))
+
+        # columns read by get_solar_data: swbt, swangle, (by), swvel, swden,
+        # swbz, (bx), hemispheric power index, hemispheric power. fields are
+        # separated by single spaces, which the original reader split on
+        swby  = walk(rng, 1440, -15, 15, 0.3)
+        swbz  = walk(rng, 1440, -20, 20, 0.3)
+        swbt  = np.sqrt(swby**2 + swbz**2)
+        swang = np.degrees(np.arctan2(swby, swbz)) % 360
+        swvel = walk(rng, 1440, 250, 900, 3)
+        swden = walk(rng, 1440, 0.5, 40, 0.2)
+        swbx  = walk(rng, 1440, -10, 10, 0.3)
+        hp    = walk(rng, 1440, 1, 150, 1)
+        hpi   = hpi_from_gw(hp)
+        os.makedirs(os.path.join(root, 'AURORA_POWER', year), exist_ok=True)
+        with open(os.path.join(root, 'AURORA_POWER', year, '{:%Y-%m-%d}-input.txt'.format(date)), 'w') as f:
+            f.write('# synthetic AURORA_POWER input\n' * HEMI_HEADER_LINES)
+            for row in zip(swbt, swang, swby, swvel, swden, swbz, swbx, hpi, hp):
+                f.write('{:.4f} {:.4f} {:.4f} {:.4f} {:.4f} {:.4f} {:.4f} {:d} {:.4f}\n'.format(*row))
+
+def write_realtime(root, start, hours, gap=0.0, seed=0):
+    # root:  output directory
+    # start: datetime of the first minute of data
+    # hours: hours of data to write
+    # gap:   fraction of geospace minutes, aurora lines and wam files left out
+    rng  = np.random.default_rng(seed)
+    mins = hours*60
+    keep = rng.random(mins) >= gap
+
+    swbx  = walk(rng, mins, -10, 10, 0.3)
+    swby  = walk(rng, mins, -15, 15, 0.3)
+    swbz  = walk(rng, mins, -20, 20, 0.3)
+    swden = walk(rng, mins, 0.5, 40, 0.2)
+    swvel = walk(rng, mins, 250, 900, 3)
+    for m in np.flatnonzero(keep):
+        t   = start + timedelta(minutes=int(m))
+        day = os.path.join(root, t.strftime('%Y%m%d'), 'swpc')
+        os.makedirs(day, exist_ok=True)
+        with open(os.path.join(day, 'geospace_input-{:%Y%m%dT%H%M}.xml'.format(t)), 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<geospace-input>\n'
+                    '  <data-item time-tag="{:%Y-%m-%dT%H:%M:%SZ}">\n'
+                    '    <mag_bx_gsm>{:.2f}</mag_bx_gsm>\n    <mag_by_gsm>{:.2f}</mag_by_gsm>\n'
+                    '    <mag_bz_gsm>{:.2f}</mag_bz_gsm>\n    <proton_density>{:.2f}</proton_density>\n'
+                    '    <proton_speed>{:.1f}</proton_speed>\n  </data-item>\n</geospace-input>\n'.format(
+                        t, swbx[m], swby[m], swbz[m], swden[m], swvel[m]))
+
+    # wam_input files are issued every WAM_CADENCE hours, each with 3-hourly
+    # values from a day before to two days after the issue time
+    steps = (hours + 3*24) // 3 + 1
+    kp    = kp_thirds(walk(rng, steps, 0, 9, 0.6))
+    kpa   = walk(rng, steps, 0, 9, 0.2)
+    f107  = walk(rng, steps, 65, 250, 2)
+    f107a = walk(rng, steps, 70, 200, 0.5)
+    first = start - timedelta(days=1)
+    for h in range(0, hours, WAM_CADENCE):
+        if rng.random() < gap:
+            continue
+        t   = start + timedelta(hours=h)
+        day = os.path.join(root, t.strftime('%Y%m%d'), 'swpc', 'wam')
+        os.makedirs(day, exist_ok=True)
+        with open(os.path.join(day, 'wam_input-{:%Y%m%dT%H%M}.xml'.format(t)), 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<wam-input>\n')
+            for k in range(h//3, h//3 + 3*8):
+                u = first + timedelta(hours=3*k)
+                f.write('  <data-item time-tag="{:%Y-%m-%dT%H:%M:%SZ}">\n'
+                        '    <f10>{:.1f}</f10>\n    <f10-41-avg>{:.1f}</f10-41-avg>\n'
+                        '    <kp>{:.2f}</kp>\n    <kp-24-hr-avg>{:.2f}</kp-24-hr-avg>\n'
+                        '  </data-item>\n'.format(u, f107[k], f107a[k], kp[k], kpa[k]))
+            f.write('</wam-input>\n')
+
+    hpn = walk(rng, mins // AURORA_CADENCE + 1, 1, 150, 2)
+    hps = walk(rng, mins // AURORA_CADENCE + 1, 1, 150, 2)
+    files = {}
+    for i in range(0, mins, AURORA_CADENCE):
+        if rng.random() < gap:
+            continue
+        t   = start + timedelta(minutes=i)
+        day = os.path.join(root, t.strftime('%Y%m%d'), 'swpc', 'wam')
+        if day not in files:
+            os.makedirs(day, exist_ok=True)
+            files[day] = open(os.path.join(day, 'swpc_aurora_power_{:%Y%m%d}.txt'.format(t)), 'w')
+            files[day].write('# synthetic aurora power\n# Observation  Forecast  North-Hemispheric-Power  South-Hemispheric-Power\n')
+        files[day].write('{:%Y-%m-%d_%H:%M}  {:%Y-%m-%d_%H:%M}  {:6.2f}  {:6.2f}\n'.format(
+                             t, t + timedelta(minutes=30), hpn[i // AURORA_CADENCE], hps[i // AURORA_CADENCE]))
+    for f in files.values():
+        f.close()
+
+def main():
+    parser = ArgumentParser(description='Write a synthetic input tree for the input parameter scripts',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('kind',               help='archive (interpolate_input_parameters.py) or realtime (parse_realtime.py)',
+                                              choices=['archive', 'realtime'])
+    parser.add_argument('-o', '--output',     help='directory to write the tree to', type=str, required=True)
+    parser.add_argument('-s', '--start_date', help='first date of data (YYYYmmddHHMM)', type=str, default='202006010000')
+    parser.add_argument('-n', '--length',     help='days of data for an archive, hours for a realtime tree', type=int, default=2)
+    parser.add_argument('-g', '--gap',        help='fraction of realtime records left out', type=float, default=0.0)
+    parser.add_argument('-r', '--seed',       help='random seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start_date, '%Y%m%d%H%M')
+    if args.kind == 'archive':
+        write_archive(args.output, datetime(start.year, start.month, start.day), args.length, args.seed)
+    else:
+        write_realtime(args.output, start, args.length, args.gap, args.seed)
+
+if __name__ == '__main__':
+    main()
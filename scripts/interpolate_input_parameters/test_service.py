@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+import parse_realtime as prt
+import synthetic_archive
+from realtime_io import record_count
+from realtime_service import DriverService, NC_NAME, TXT_NAME
+from watcher import DriverWatcher
+
+# DriverService, as run by realtime_wrapper.py -S, over a small synthetic
+# realtime tree. the service writes to the working directory, so each test
+# runs in a temporary one. run with python -m pytest or python -m unittest
+# from this directory
+
+START    = datetime(2020, 6, 1, 1)
+DURATION = 15
+TIMEOUT  = 30 # seconds a service run may take
+
+class DriverServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd  = os.getcwd()
+        self.path = tempfile.mkdtemp()
+        synthetic_archive.write_realtime(self.path + '/rt', START - timedelta(hours=1), 4, gap=0.05)
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path)
+
+    def parameters(self, start, mins, append, incremental):
+        end = datetime.strptime(prt.EDATE, '%Y%m%d%H%M')
+        return prt.InputParameters(start, mins, self.path + '/rt', NC_NAME, append, True, end, end, end,
+                                   incremental=incremental)
+
+    def run_service(self, incremental):
+        # the first hour as parse_realtime.py writes it, then an hour of
+        # segments appended by the service as the wrapper would run it
+        ip = self.parameters(START, 60, False, False)
+        ip.parse()
+        ip.netcdf_output()
+        ip.outfile = TXT_NAME
+        ip.output()
+        ip.close()
+
+        start = START + timedelta(hours=1)
+        end   = start + timedelta(hours=1)
+        ip = self.parameters(start, DURATION, True, incremental)
+        ip.parse()
+        watcher = DriverWatcher(self.path + '/rt', notify=False)
+        service = DriverService(ip, watcher, start, end, DURATION, 'status.json', sleep_time=0)
+        try:
+            # a stage that keeps failing retries forever
+            asyncio.run(asyncio.wait_for(service.run(), TIMEOUT))
+        except asyncio.TimeoutError:
+            pass
+        watcher.close()
+        ip.close()
+
+        with open('status.json') as f:
+            status = json.load(f)
+        self.assertEqual(status['errors'], 0, status['last_error'])
+        self.assertEqual(status['written_until'], end.strftime('%Y-%m-%dT%H:%M:%S'))
+        self.assertEqual(record_count(NC_NAME), 120)
+        with open(TXT_NAME) as f:
+            rows = f.read().splitlines()[5:]
+        self.assertEqual(len(rows), 120)
+        self.assertTrue(rows[-1].startswith((end - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M')))
+
+    def test_segments_written(self):
+        self.run_service(False)
+
+    def test_segments_written_incremental(self):
+        self.run_service(True)
+
+if __name__ == '__main__':
+    unittest.main()
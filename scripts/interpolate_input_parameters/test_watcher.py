@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from parse_realtime import DELAY_INTERVAL, L1_DELAY
+from watcher import DriverWatcher
+
+# DriverWatcher over a small realtime input tree built in a temporary
+# directory. run with python -m pytest or python -m unittest from this
+# directory
+
+class DriverWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def publish(self, dt):
+        # a geospace_input file and an aurora power file ending at datetime dt
+        day = '{}/{}/swpc'.format(self.path, dt.strftime('%Y%m%d'))
+        os.makedirs(day + '/wam', exist_ok=True)
+        open(dt.strftime(day + '/geospace_input-%Y%m%dT%H%M.xml'), 'w').close()
+        with open(dt.strftime(day + '/wam/swpc_aurora_power_%Y%m%d.txt'), 'a') as f:
+            f.write(dt.strftime('%Y-%m-%d_%H:%M') + ' 10.00 10.00\n')
+
+    def expected(self, dt):
+        return min(dt + timedelta(minutes=DELAY_INTERVAL), dt + timedelta(minutes=L1_DELAY))
+
+    def test_consecutive_days(self):
+        watcher = DriverWatcher(self.path, notify=False)
+        self.publish(datetime(2020, 6, 1, 12))
+        self.assertEqual(watcher.latest_date(), self.expected(datetime(2020, 6, 1, 12)))
+        self.publish(datetime(2020, 6, 2, 6))
+        self.assertEqual(watcher.latest_date(), self.expected(datetime(2020, 6, 2, 6)))
+        watcher.close()
+
+    def test_missing_day(self):
+        # no directory for 20200602, the watcher must still find 20200603
+        watcher = DriverWatcher(self.path, notify=False)
+        self.publish(datetime(2020, 6, 1, 12))
+        self.assertEqual(watcher.latest_date(), self.expected(datetime(2020, 6, 1, 12)))
+        self.publish(datetime(2020, 6, 3, 6))
+        self.assertEqual(watcher.latest_date(), self.expected(datetime(2020, 6, 3, 6)))
+        self.publish(datetime(2020, 6, 4, 1))
+        self.assertEqual(watcher.latest_date(), self.expected(datetime(2020, 6, 4, 1)))
+        watcher.close()
+
+if __name__ == '__main__':
+    unittest.main()
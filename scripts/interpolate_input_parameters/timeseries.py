@@ -0,0 +1,246 @@
+from copy import copy
+from datetime import timedelta
+from math import exp
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# minute-cadence time series for the realtime drivers. values are stored in a
+# float64 array indexed by minutes from self.base, with an explicit mask of
+# minutes that hold no value yet. the operations mirror what parse_realtime
+# used to do with datetime-keyed dicts: assign observations, clear a window,
+# interpolate gaps, relax toward a driver climatology, and trailing means.
+# minutes filled by interpolation or relaxation are marked in self.filled,
+# so observed minutes can be told from filled ones.
+
+RELAX_BLOCK = 720 # minutes per closed-form relax step, keeps its exp(block/time_constant) scale factors small
+
+class TimeSeries(object):
+    def __init__(self):
+        self.base    = None                      # datetime of index 0
+        self.values  = np.empty(0)
+        self.missing = np.empty(0, dtype=bool)
+        self.filled  = np.empty(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.values)
+
+    def offset(self, dt):
+        # minutes from base to datetime dt
+        return int((dt - self.base).total_seconds() // 60)
+
+    def time(self, i):
+        return self.base + timedelta(minutes=int(i))
+
+    def reserve(self, start, count):
+        # grow the series to cover count minutes from datetime start, new
+        # minutes are missing. returns the index of start
+        if self.base is None:
+            self.base = start
+        i = self.offset(start)
+        if i < 0:
+            self.values  = np.concatenate([np.full(-i, np.nan), self.values])
+            self.missing = np.concatenate([np.ones(-i, dtype=bool), self.missing])
+            self.filled  = np.concatenate([np.zeros(-i, dtype=bool), self.filled])
+            self.base = start
+            i = 0
+        if i + count > len(self):
+            n = i + count - len(self)
+            self.values  = np.concatenate([self.values, np.full(n, np.nan)])
+            self.missing = np.concatenate([self.missing, np.ones(n, dtype=bool)])
+            self.filled  = np.concatenate([self.filled, np.zeros(n, dtype=bool)])
+        return i
+
+    def assign(self, times, values):
+        # store values at the datetimes in times, later duplicates win
+        if len(times) == 0:
+            return
+        self.reserve(min(times), 0)
+        self.reserve(max(times), 1)
+        idx = np.array([self.offset(t) for t in times])
+        self.values[idx]  = values
+        self.missing[idx] = False
+        self.filled[idx]  = False
+
+    def clear(self, start, count):
+        i = self.reserve(start, count)
+        self.values[i:i+count]  = np.nan
+        self.missing[i:i+count] = True
+        self.filled[i:i+count]  = False
+
+    def last_observed(self, before):
+        # datetime of the last stored, unfilled minute before datetime before
+        if self.base is None:
+            return None
+        i = min(max(0, self.offset(before)), len(self))
+        obs = np.flatnonzero(~(self.missing[:i] | self.filled[:i]))
+        return self.time(obs[-1]) if len(obs) else None
+
+    def observed(self, dt):
+        # whether datetime dt holds a stored value that is not a fill
+        i = self.offset(dt) if self.base is not None else -1
+        return 0 <= i < len(self) and not (self.missing[i] or self.filled[i])
+
+    def __setitem__(self, dt, value):
+        self.assign([dt], [value])
+
+    def __getitem__(self, dt):
+        i = self.offset(dt) if self.base is not None else -1
+        if i < 0 or i >= len(self) or self.missing[i]:
+            raise KeyError(dt)
+        return self.values[i]
+
+    def __contains__(self, dt):
+        i = self.offset(dt) if self.base is not None else -1
+        return 0 <= i < len(self) and not self.missing[i]
+
+    def put(self, start, values):
+        # store contiguous values from datetime start
+        i = self.reserve(start, len(values))
+        self.values[i:i+len(values)]  = values
+        self.missing[i:i+len(values)] = False
+        self.filled[i:i+len(values)]  = False
+
+    def window(self, start, count):
+        # copy of the values for count minutes from datetime start
+        i = self.reserve(start, count)
+        return self.values[i:i+count].copy()
+
+    def nanmean(self):
+        return np.nanmean(self.values[~self.missing])
+
+    def copy(self):
+        # shallow copy keeps subclass attributes, the arrays are duplicated
+        out = copy(self)
+        out.values  = self.values.copy()
+        out.missing = self.missing.copy()
+        out.filled  = self.filled.copy()
+        return out
+
+    def map(self, func):
+        # new series with func applied to the stored values
+        out = self.copy()
+        out.values[~out.missing] = func(self.values[~self.missing])
+        return out
+
+    def interpolate(self, start, count, cutoff=False):
+        # fill the missing minutes of the window linearly between stored
+        # values anywhere in the series. minutes before the first value take
+        # it; minutes after the last take it too unless cutoff is set, in
+        # which case they stay missing
+        i = self.reserve(start, count)
+        ok = np.flatnonzero(~self.missing)
+        if len(ok) == 0:
+            return
+        gaps = i + np.flatnonzero(self.missing[i:i+count])
+        if cutoff:
+            gaps = gaps[gaps < ok[-1]]
+        self.values[gaps]  = np.interp(gaps, ok, self.values[ok])
+        self.missing[gaps] = False
+        self.filled[gaps]  = True
+
+    def relax(self, start, count, relax_func, time_constant):
+        # fill the missing minutes of the window in time order, each decaying
+        # from the previous minute toward relax_func(start, count)[minute]
+        # with e-folding time time_constant minutes, or taking relax_func
+        # outright when the previous minute has no value either. relax_func
+        # gives the targets of the whole window, as an array or a scalar
+        i = self.reserve(start, count)
+        gaps = self.missing[i:i+count].copy()
+        if not gaps.any():
+            return
+        fac    = exp(-1./time_constant)
+        target = np.broadcast_to(np.asarray(relax_func(start, count), dtype='float64'), (count,))
+        vals   = self.values[i:i+count]
+        prev   = 0.
+        if gaps[0]:
+            if i > 0 and not self.missing[i-1]:
+                prev = self.values[i-1]
+            else:
+                vals[0] = target[0]
+                gaps[0] = False
+        for j in range(0, count, RELAX_BLOCK):
+            block = slice(j, j+RELAX_BLOCK)
+            if gaps[block].any():
+                vals[block] = relax_block(prev, vals[block], gaps[block], target[block], fac)
+            prev = vals[block][-1]
+        self.filled[i:i+count]  |= self.missing[i:i+count]
+        self.missing[i:i+count]  = False
+
+    def trailing_mean(self, start, count, averaging_time):
+        # trailing mean over averaging_time minutes for count minutes from
+        # datetime start, minutes before the series start take its first
+        # value. missing minutes are left out of the mean. each mean is summed
+        # over its own window, so it does not depend on where the call starts
+        i   = self.reserve(start, count)
+        ok  = ~self.missing
+        lo  = i - (averaging_time - 1)
+        avg = RollingMean(averaging_time)
+        if lo >= 0:
+            avg.carry(self.values[lo:i], ok[lo:i])
+        else:
+            first = self.values[np.argmax(ok)] if ok.any() else 0.
+            avg.carry(np.concatenate([np.full(-lo, first), self.values[:i]]),
+                      np.concatenate([np.full(-lo, ok.any()), ok[:i]]))
+        return avg.append(self.values[i:i+count], ok[i:i+count])
+
+class RollingMean(object):
+    # trailing mean over window samples of a series given block by block.
+    # the last window-1 samples are carried from one append to the next and
+    # every mean is summed over its own window, so a series appended in
+    # blocks gives the same means as appended at once. samples that are not
+    # ok are left out of the mean. without carry, the window reaches back
+    # over copies of the first sample appended
+    def __init__(self, window):
+        self.window = window
+        self.values = None # last window-1 samples, 0 where not ok
+        self.counts = None # 1 where values holds a sample
+
+    def carry(self, values, ok=None):
+        # take the samples preceding the next append, at least window-1 of them
+        values, ok = self.samples(values, ok)
+        keep = len(values) - (self.window - 1)
+        self.values = values[keep:]
+        self.counts = ok[keep:].astype('float64')
+
+    def samples(self, values, ok):
+        values = np.asarray(values, dtype='float64')
+        ok     = ~np.isnan(values) if ok is None else np.asarray(ok, dtype=bool)
+        return np.where(ok, values, 0.), ok
+
+    def append(self, values, ok=None):
+        # means of the windows ending at each of values
+        values, ok = self.samples(values, ok)
+        if self.values is None:
+            first = values[np.argmax(ok)] if ok.any() else 0.
+            self.carry(np.full(self.window - 1, first), np.full(self.window - 1, ok.any()))
+        vals = np.concatenate([self.values, values])
+        cnt  = np.concatenate([self.counts, ok])
+        sums = sliding_window_view(vals, self.window).sum(axis=1)
+        ns   = sliding_window_view(cnt,  self.window).sum(axis=1)
+        keep = len(vals) - (self.window - 1)
+        self.values = vals[keep:]
+        self.counts = cnt[keep:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / ns
+
+def relax_block(prev, vals, gaps, target, fac):
+    # vals with each gap k set to fac*v[k-1] + (1-fac)*target[k], v[-1] being
+    # prev. after the last value v[r] before k this sums to
+    #   v[k] = (w[r]*v[r] + s[k] - s[r]) / w[k]
+    # with w[k] = fac**-(k+1) and s the cumulative sum of (1-fac)*w*target,
+    # so the whole block is a few array operations. a nan target spoils the
+    # gaps after it up to the next value, as the step by step recurrence does
+    n     = len(vals)
+    w     = fac ** -np.arange(n+1.)
+    bad   = gaps & np.isnan(target)
+    terms = np.where(gaps & ~bad, target, 0.) * (1-fac) * w[1:]
+    s     = np.concatenate([[0.], np.cumsum(terms)])
+    nans  = np.concatenate([[0], np.cumsum(bad)])
+    v     = np.concatenate([[prev], vals])
+    pos   = np.arange(n+1)
+    last  = np.maximum.accumulate(np.where(np.concatenate([[True], ~gaps]), pos, 0))
+    k     = 1 + np.flatnonzero(gaps)
+    r     = last[k]
+    out   = vals.copy()
+    out[k-1] = np.where(nans[k] > nans[r], np.nan, (w[r]*v[r] + s[k] - s[r]) / w[k])
+    return out
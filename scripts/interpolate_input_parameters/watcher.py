@@ -0,0 +1,178 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from datetime import datetime, timedelta
+from parse_realtime import DELAY_INTERVAL, L1_DELAY, PATH_FMT
+from realtime_io import last_line, LatestIndex
+
+# newest geospace_input and aurora power times under a realtime input path.
+# the index is refreshed by probing the newest known day directory and the
+# days after it, so a check does not grow with the archive. the newest files
+# can be persisted with LatestIndex so a restart skips the initial listing.
+# on linux, inotify wakes wait() as soon as something lands in a watched
+# directory; elsewhere, or where inotify is unavailable, wait() just sleeps
+# and the next check polls. inotify only sees changes made on this node, so
+# on shared filesystems the poll after the timeout remains the fallback.
+
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_NONBLOCK    = 0o4000
+WATCH_MASK     = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+SW_PREFIX = 'geospace_input-'
+HP_PREFIX = 'swpc_aurora_power_'
+
+def get_sw_date(filename):
+    return datetime.strptime(filename,'geospace_input-%Y%m%dT%H%M.xml') + \
+           timedelta(minutes = DELAY_INTERVAL)
+
+def get_hp_date(filename):
+    line = last_line(filename).split()
+    try:
+        return datetime.strptime("{}{}".format(line[0],line[1]),'%Y-%m-%d%H:%M') + \
+               timedelta(minutes = L1_DELAY)
+    except:
+        return datetime.strptime("{}".format(line[0]),'%Y-%m-%d_%H:%M') + \
+               timedelta(minutes = L1_DELAY)
+
+def _libc():
+    # libc with the inotify calls, or None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+def _listdir(path, prefix=''):
+    try:
+        return [name for name in os.listdir(path) if name.startswith(prefix)]
+    except OSError:
+        return []
+
+class DriverWatcher(object):
+    def __init__(self, path, notify=True, index=None):
+        self.path    = path
+        self.index   = LatestIndex(index) # day/filename of the newest file per source
+        self.sw_day  = '' # newest day directory holding geospace_input files
+        self.sw_date = None
+        self.hp_day  = '' # newest day directory holding an aurora power file
+        self.hp_file = None
+        self.hp_stat = None
+        self.hp_date = None
+
+        sw = self.index.get('geospace_input')
+        if sw is not None:
+            self.sw_day, name = sw.split('/')
+            self.sw_date = get_sw_date(name)
+        hp = self.index.get('aurora_power')
+        if hp is not None:
+            self.hp_day  = hp.split('/')[0]
+            self.hp_file = '{}/{}/swpc/wam/{}'.format(self.path, *hp.split('/'))
+
+        self.libc    = _libc() if notify else None
+        self.fd      = -1
+        self.watches = {} # directory -> watch descriptor
+        if self.libc is not None:
+            self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+            if self.fd < 0:
+                self.libc = None
+
+    def days(self, since):
+        # day directories from since on, newest first. from a known day the
+        # following days are probed in turn. at the first missing day path is
+        # listed for any later ones, so a day skipped by an outage does not
+        # hold the index back. an empty since lists path outright
+        if not since:
+            return self.listed_days('')
+        days = [since]
+        day  = datetime.strptime(since, PATH_FMT)
+        while True:
+            day += timedelta(days=1)
+            name = day.strftime(PATH_FMT)
+            if not os.path.isdir('{}/{}'.format(self.path, name)):
+                return self.listed_days(name) + days[::-1]
+            days.append(name)
+
+    def listed_days(self, since):
+        # day directories listed under path from since on, newest first
+        return sorted([d for d in _listdir(self.path) if len(d) == 8 and d.isdigit() and d >= since], reverse=True)
+
+    def refresh(self):
+        days = self.days(min(self.sw_day, self.hp_day))
+        for day in days:
+            if day < self.sw_day:
+                break
+            names = _listdir('{}/{}/swpc'.format(self.path, day), SW_PREFIX)
+            if names:
+                self.sw_day  = day
+                self.sw_date = get_sw_date(max(names))
+                self.index.update('geospace_input', '{}/{}'.format(day, max(names)))
+                break
+        for day in days:
+            if day < self.hp_day:
+                break
+            names = _listdir('{}/{}/swpc/wam'.format(self.path, day), HP_PREFIX)
+            if names:
+                self.hp_day  = day
+                self.hp_file = '{}/{}/swpc/wam/{}'.format(self.path, day, max(names))
+                self.index.update('aurora_power', '{}/{}'.format(day, max(names)))
+                break
+        self.read_hp_date()
+        if days:
+            self.watch(days[0])
+
+    def read_hp_date(self):
+        # last aurora power time, only reread when the file has changed
+        try:
+            st = os.stat(self.hp_file)
+            if (st.st_size, st.st_mtime_ns) != self.hp_stat:
+                self.hp_date = get_hp_date(self.hp_file)
+                self.hp_stat = (st.st_size, st.st_mtime_ns)
+        except:
+            self.hp_date = None
+            self.hp_stat = None
+
+    def latest_date(self):
+        # time up to which both geospace and aurora power data are in
+        self.refresh()
+        if self.sw_date is None:
+            return datetime.min
+        hp_date = self.hp_date if self.hp_date is not None else self.sw_date - timedelta(days=1)
+        return min(self.sw_date, hp_date)
+
+    def watch(self, day):
+        # watch the top directory for new days and the newest day's inputs
+        if self.libc is None:
+            return
+        dirs = [self.path, '{}/{}'.format(self.path, day),
+                '{}/{}/swpc'.format(self.path, day), '{}/{}/swpc/wam'.format(self.path, day)]
+        for d in list(self.watches):
+            if d not in dirs:
+                self.libc.inotify_rm_watch(self.fd, self.watches.pop(d))
+        for d in dirs:
+            if d not in self.watches and os.path.isdir(d):
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+                if wd >= 0:
+                    self.watches[d] = wd
+
+    def wait(self, timeout):
+        # sleep up to timeout seconds, returning early on inotify events
+        if self.libc is None or not self.watches:
+            time.sleep(timeout)
+            return
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -9,14 +9,19 @@ matplotlib.use('agg') # cannot plt.show() with this, but pyplot fails on the com
 import matplotlib.pyplot as plt
 from matplotlib import ticker
 from mpl_toolkits.basemap import Basemap
+from mpl_toolkits.axes_grid1 import make_axes_locatable
 from os import listdir, path, makedirs
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from netCDF4 import Dataset
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import glob
 import yaml
 import io
 import numpy as np
 import errno
+import sys
 
 def mkdir_p(file_path):
   try:
@@ -28,113 +33,188 @@ def mkdir_p(file_path):
       raise
 
 # ----------------------------------------------------------------------------- #
-## parsing options
-parser = ArgumentParser(description='Make plots from height-gridded NetCDF IPE output', formatter_class=ArgumentDefaultsHelpFormatter)
-parser.add_argument('-i', '--input_directory',  help='directory where IPE height-gridded NetCDF files are stored', type=str, required=True)
-parser.add_argument('-o', '--output_directory', help='directory where plots are stored', type=str, required=True)
-args = parser.parse_args()
-
-# create output path if it doesn't yet exist
-mkdir_p(args.output_directory)
-
-# Parse the plot_settings.yaml file
-with open('plot_settings.yaml', 'r' ) as stream:
-  plot_settings = yaml.load(stream)
-
-
-for plt_obj in plot_settings["plots"]:
-
-  # If the netcdf_prefix is given, create a list of files
-  if plt_obj['plot']['netcdf_prefix']:
-    nc_files = glob.glob(args.input_directory+'/'+plt_obj['plot']['netcdf_prefix']+'*.nc')
-
-
-  mymin   = plt_obj['plot']['minimum']
-  mymax   = plt_obj['plot']['maximum']
-  ncolors = plt_obj['plot']['n_colors']
-  myticks = plt_obj['plot']['n_ticks']
-  units   = plt_obj['plot']['units']
-  ncontours = plt_obj['plot']['n_contours']
-  mycolormap = plt_obj['plot']['color_map']
-  
-
-  for nc_file in nc_files:
-
-    # Gather data
-    dataset = Dataset(path.join(args.input_directory,nc_file))
-    timestamp = nc_file.split(".")[3]
-    year    = timestamp[0:4]
-    month   = timestamp[4:6]
-    day     = timestamp[6:8]
-    hour    = timestamp[8:10]
-    minute  = timestamp[10:12]
-    datestamp = day+'/'+month+'/'+year+' UT '+hour+':'+minute
-    print( ' Reading file     : '+path.join(args.input_directory,nc_file) )
-    print( ' Model date       : '+datestamp)
-    print( ' Reading variable : '+plt_obj['plot']['netcdf_name'])
-  
-
-    for plot_type in plt_obj['plot']['type']:
-
-      print( ' > > Creating  '+plot_type+' plot.')
-
-      lon = dataset.variables['longitude'][:]
-      if plot_type == 'polar':
-        lon = np.append(lon,lon[0])
-
-      lat = dataset.variables['latitude'][:]
-      if plt_obj['plot']['altitude'] > 0 :
-        # Spatial 3-D data set
-        # Ultimately, we will do vertical interpolation here.
-        data = dataset.variables[plt_obj['plot']['netcdf_name']][0,47,:,:]
-      else:
-        # Spatial 2-D data set
-        data = dataset.variables[plt_obj['plot']['netcdf_name']][0,:,:]
-
-
-      plt.figure()
-  
-      if plot_type == 'polar':
-        m = Basemap(lon_0=0,lat_0=90,projection='ortho')
-      else:
-        m = Basemap(llcrnrlon=lon[0],llcrnrlat=lat[0],urcrnrlon=lon[-1],urcrnrlat=lat[-1],projection='cyl')
-  
-      lon,lat = np.meshgrid(lon,lat)
-      x,y = m(lon,lat)
-  
-      if plot_type == 'polar':
-        b = np.reshape(data[:,0],(-1,1))
-        data = np.hstack((data,b))
-  
-      m.drawcoastlines()
-      m.drawstates()
-      m.drawcountries()
-  
-      if mymin == mymax :
-        cmap = m.contourf(x,y, data)
-      else:
-        cmap = m.contourf(x,y, data, np.linspace(mymin, mymax, ncolors), cmap=mycolormap)
-  
-      if ncontours > 0:
-        m.contour(x,y, data, np.linspace(mymin, mymax, ncontours), colors=plot_settings['plot_settings']['contour_line_color'], 
-                                                                   linewidths=plot_settings['plot_settings']['contour_line_width'])	
-  
-      if mymin == mymax :
-         cbar = m.colorbar(cmap)
-      else:
-        cbar = m.colorbar(cmap, ticks=np.linspace(mymin,mymax,myticks))
-  
-      cbar.ax.yaxis.label.set_font_properties(matplotlib.font_manager.FontProperties(family=plot_settings['plot_settings']['font_family'],
-                                                                                     size=plot_settings['plot_settings']['font_size']))
-      cbar.ax.set_title('['+units+']',y=1.04)
-  
-      if plot_type == 'mercator':
-         plt.xticks([0, 90, 180, 270, 360],['$0^o E$', '$90^o E$', '$180^o E$', '$270^o E$', '$360^o E$'])
-         plt.yticks([-90, -45, 0, 45, 90],['$90^o S$', '$45^o S$', '$0^o$', '$45^o N$', '$90^o N$'])
-         plt.grid()
-      
-      plt.title(plt_obj['plot']['title']+'\n'+datestamp, fontsize=plot_settings['plot_settings']['title_font_size'], 
-                                                     fontname=plot_settings['plot_settings']['font_family'])
-      # output
-      plt.savefig(path.join(args.output_directory,plt_obj['plot']['save_name']+'.'+plot_type+'.'+timestamp+'.eps'))
-      plt.close()
+def plot_jobs(plots, input_directory, output_directory):
+  # (plot, netcdf file, plot type, eps file) of every figure, in the order the
+  # plots, files and plot types are listed. a figure saved under the same name
+  # as an earlier one replaces it, as its file would have been overwritten
+  jobs = OrderedDict()
+  nc_files = []
+  for plt_obj in plots:
+
+    # If the netcdf_prefix is given, create a list of files
+    if plt_obj['plot']['netcdf_prefix']:
+      nc_files = sorted(glob.glob(input_directory+'/'+plt_obj['plot']['netcdf_prefix']+'*.nc'))
+
+    for nc_file in nc_files:
+      timestamp = nc_file.split(".")[3]
+      for plot_type in plt_obj['plot']['type']:
+        eps_file = path.join(output_directory,plt_obj['plot']['save_name']+'.'+plot_type+'.'+timestamp+'.eps')
+        jobs.pop(eps_file, None)
+        jobs[eps_file] = (plt_obj['plot'], nc_file, plot_type, eps_file)
+  return list(jobs.values())
+
+# projections drawn by this process, keyed by plot type and grid
+projections = {}
+
+class Projection(object):
+  # a figure holding the Basemap and map background of one plot type on one
+  # longitude/latitude grid, with the grid projected to map coordinates.
+  # each frame on that grid removes the data layer of the last, then draws
+  # and saves its own, so the map is only built and its coastlines drawn once
+  def __init__(self, plot_type, lon, lat):
+    if plot_type == 'polar':
+      lon = np.append(lon,lon[0])
+
+    self.figure = plt.figure()
+
+    if plot_type == 'polar':
+      self.m = Basemap(lon_0=0,lat_0=90,projection='ortho')
+    else:
+      self.m = Basemap(llcrnrlon=lon[0],llcrnrlat=lat[0],urcrnrlon=lon[-1],urcrnrlat=lat[-1],projection='cyl')
+
+    lon,lat = np.meshgrid(lon,lat)
+    self.x,self.y = self.m(lon,lat)
+
+    self.m.drawcoastlines()
+    self.m.drawstates()
+    self.m.drawcountries()
+
+    # colorbar axes laid out as Basemap.colorbar does, cleared for each frame
+    self.axes = plt.gca()
+    self.cax  = make_axes_locatable(self.axes).append_axes('right', size='5%', pad='2%')
+    self.layer = []
+
+  def clear(self):
+    # remove the data layer of the last frame, if any
+    for artist in self.layer:
+      artist.remove()
+    self.layer = []
+    self.cax.cla()
+
+def projection(plot_type, lon, lat):
+  # the Projection of plot_type on the lon/lat grid, built on first use
+  key = (plot_type, lon.tobytes(), lat.tobytes())
+  if key not in projections:
+    projections[key] = Projection(plot_type, lon, lat)
+  return projections[key]
+
+def render(settings, plot, nc_file, plot_type, eps_file):
+  # draw one figure of plot from nc_file and save it to eps_file
+  mymin   = plot['minimum']
+  mymax   = plot['maximum']
+  ncolors = plot['n_colors']
+  myticks = plot['n_ticks']
+  units   = plot['units']
+  ncontours = plot['n_contours']
+  mycolormap = plot['color_map']
+
+  # Gather data
+  timestamp = nc_file.split(".")[3]
+  year    = timestamp[0:4]
+  month   = timestamp[4:6]
+  day     = timestamp[6:8]
+  hour    = timestamp[8:10]
+  minute  = timestamp[10:12]
+  datestamp = day+'/'+month+'/'+year+' UT '+hour+':'+minute
+  print( ' Reading file     : '+nc_file )
+  print( ' Model date       : '+datestamp)
+  print( ' Reading variable : '+plot['netcdf_name'])
+  print( ' > > Creating  '+plot_type+' plot.')
+
+  with Dataset(nc_file) as dataset:
+    lon = np.asarray(dataset.variables['longitude'][:])
+    lat = np.asarray(dataset.variables['latitude'][:])
+    if plot['altitude'] > 0 :
+      # Spatial 3-D data set
+      # Ultimately, we will do vertical interpolation here.
+      data = dataset.variables[plot['netcdf_name']][0,47,:,:]
+    else:
+      # Spatial 2-D data set
+      data = dataset.variables[plot['netcdf_name']][0,:,:]
+
+  proj = projection(plot_type, lon, lat)
+  m, x, y = proj.m, proj.x, proj.y
+  proj.clear()
+  plt.figure(proj.figure.number)
+  plt.sca(proj.axes)
+
+  if plot_type == 'polar':
+    b = np.reshape(data[:,0],(-1,1))
+    data = np.hstack((data,b))
+
+  if mymin == mymax :
+    cmap = m.contourf(x,y, data)
+  else:
+    cmap = m.contourf(x,y, data, np.linspace(mymin, mymax, ncolors), cmap=mycolormap)
+  proj.layer.append(cmap)
+
+  if ncontours > 0:
+    proj.layer.append(m.contour(x,y, data, np.linspace(mymin, mymax, ncontours), colors=settings['contour_line_color'],
+                                                                                 linewidths=settings['contour_line_width']))
+
+  if mymin == mymax :
+     cbar = plt.colorbar(cmap, cax=proj.cax)
+  else:
+    cbar = plt.colorbar(cmap, cax=proj.cax, ticks=np.linspace(mymin,mymax,myticks))
+  plt.sca(proj.axes)
+
+  cbar.ax.yaxis.label.set_font_properties(matplotlib.font_manager.FontProperties(family=settings['font_family'],
+                                                                                 size=settings['font_size']))
+  cbar.ax.set_title('['+units+']',y=1.04)
+
+  if plot_type == 'mercator':
+     plt.xticks([0, 90, 180, 270, 360],['$0^o E$', '$90^o E$', '$180^o E$', '$270^o E$', '$360^o E$'])
+     plt.yticks([-90, -45, 0, 45, 90],['$90^o S$', '$45^o S$', '$0^o$', '$45^o N$', '$90^o N$'])
+     plt.grid(True)
+
+  plt.title(plot['title']+'\n'+datestamp, fontsize=settings['title_font_size'],
+                                          fontname=settings['font_family'])
+  # output
+  plt.savefig(eps_file)
+
+def render_all(jobs, settings, workers=1):
+  # render the jobs here when workers is 1, else on a pool of that many
+  # processes, None for one per cpu. every job writes its own eps file, so
+  # the output does not depend on the order they finish in. returns the eps
+  # files of the jobs that failed on the pool
+  if workers == 1:
+    for job in jobs:
+      render(settings, *job)
+    return []
+
+  failed  = []
+  methods = multiprocessing.get_all_start_methods()
+  context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+  with ProcessPoolExecutor(workers, mp_context=context) as pool:
+    futures = dict((pool.submit(render, settings, *job), job[-1]) for job in jobs)
+    for future in as_completed(futures):
+      try:
+        future.result()
+      except Exception as e:
+        print( ' Failed '+futures[future]+' : '+str(e) )
+        failed.append(futures[future])
+  return sorted(failed)
+
+def main():
+  ## parsing options
+  parser = ArgumentParser(description='Make plots from height-gridded NetCDF IPE output', formatter_class=ArgumentDefaultsHelpFormatter)
+  parser.add_argument('-i', '--input_directory',  help='directory where IPE height-gridded NetCDF files are stored', type=str, required=True)
+  parser.add_argument('-o', '--output_directory', help='directory where plots are stored', type=str, required=True)
+  parser.add_argument('-j', '--workers',          help='processes rendering plots, 0 for one per cpu', type=int, default=1)
+  args = parser.parse_args()
+
+  # create output path if it doesn't yet exist
+  mkdir_p(args.output_directory)
+
+  # Parse the plot_settings.yaml file
+  with open('plot_settings.yaml', 'r' ) as stream:
+    plot_settings = yaml.load(stream)
+
+  jobs = plot_jobs(plot_settings["plots"], args.input_directory, args.output_directory)
+  failed = render_all(jobs, plot_settings['plot_settings'], args.workers or None)
+  if failed:
+    print( ' '+str(len(failed))+' of '+str(len(jobs))+' plots failed' )
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()